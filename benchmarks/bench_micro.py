@@ -0,0 +1,106 @@
+import copy
+import random
+from typing import Any, Dict
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from benchmarks.synthetic import (  # noqa: E402
+    load_settings,
+    make_judge_output,
+    make_messages,
+    make_outputs,
+    make_result,
+)
+from src.build_player_html import generate_html  # noqa: E402
+from src.build_table_v2 import bootstrap_mean  # noqa: E402
+from src.provider import LLMProvider  # noqa: E402
+from src.util import encode_prompt, parse_output, prepare_request, save  # noqa: E402
+
+
+SETTINGS = load_settings()
+CHARACTER = SETTINGS.characters[0]
+SITUATION = SETTINGS.situations[0]
+MESSAGES = make_messages(random.Random(42), num_turns=8)
+
+
+def test_encode_character_prompt(benchmark: Any) -> None:
+    benchmark(encode_prompt, SETTINGS.character_prompt_path, character=CHARACTER)
+
+
+def test_encode_judge_prompt(benchmark: Any) -> None:
+    char_description = encode_prompt(SETTINGS.character_prompt_path, character=CHARACTER)
+    benchmark(
+        encode_prompt,
+        SETTINGS.judge_user_prompt_path,
+        char_description=char_description,
+        situation=SITUATION.text,
+        messages=MESSAGES,
+    )
+
+
+@pytest.mark.parametrize("merge_system", [False, True])
+def test_prepare_request(benchmark: Any, merge_system: bool) -> None:
+    # No request is sent, the client is only constructed
+    provider = LLMProvider(
+        model_name="synthetic",
+        base_url="http://127.0.0.1:1/v1",
+        api_key="none",
+        system_prompt="Be brief.",
+        merge_system=merge_system,
+    )
+    system_message = encode_prompt(SETTINGS.character_prompt_path, character=CHARACTER)
+    messages = [{"role": "system", "content": system_message}] + MESSAGES
+    benchmark(prepare_request, messages, provider, temperature=0.1)
+
+
+@pytest.mark.parametrize("num_turns,messy", [(4, False), (4, True), (16, False), (16, True)])
+def test_parse_output(benchmark: Any, num_turns: int, messy: bool) -> None:
+    output = make_judge_output(num_turns=num_turns, messy=messy)
+    record = benchmark(parse_output, output)
+    assert len(record["scores"]) == num_turns
+
+
+@pytest.mark.parametrize("num_turns", [4, 16])
+def test_parse_broken_output(benchmark: Any, num_turns: int) -> None:
+    output = make_judge_output(num_turns=num_turns, messy=True, broken=True)
+    record = benchmark(parse_output, output)
+    assert len(record["scores"]) == num_turns
+
+
+@pytest.mark.parametrize("num_outputs", [10, 100, 1000])
+def test_save(benchmark: Any, tmp_path: Any, num_outputs: int) -> None:
+    data = make_result(num_outputs)
+    output_path = str(tmp_path / "result.json")
+
+    def run() -> None:
+        save(
+            output_path=output_path,
+            outputs=copy.deepcopy(data["outputs"]),
+            interrogator_provider=data["interrogator"],
+            judge_provider=data["judge"],
+            player_provider=data["player"],
+            version=data["version"],
+        )
+
+    benchmark.pedantic(run, rounds=5 if num_outputs == 1000 else 20, warmup_rounds=1)
+
+
+@pytest.mark.parametrize("size", [64, 512])
+def test_bootstrap_mean(benchmark: Any, size: int) -> None:
+    rng = random.Random(42)
+    data = [rng.uniform(1.0, 5.0) for _ in range(size)]
+    benchmark(bootstrap_mean, data, 1000)
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_generate_html(benchmark: Any, tmp_path: Any, lazy: bool) -> None:
+    data: Dict[str, Any] = {
+        "outputs": make_outputs(64),
+        "player": {"model_name": "synthetic-player", "short_name": "player"},
+        "judge": {"model_name": "synthetic-judge", "short_name": "judge"},
+        "interrogator": {"model_name": "synthetic-interrogator"},
+    }
+    shards_path = str(tmp_path / "shards") if lazy else None
+    benchmark(generate_html, data, shards_path=shards_path, shards_url="shards" if lazy else None)
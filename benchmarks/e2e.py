@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import socket
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+import fire  # type: ignore
+from tabulate import tabulate
+
+from benchmarks.mock_server import serve
+
+
+SCENARIOS = ("eval_v2", "judge", "eval_v1")
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port: int = s.getsockname()[1]
+        return port
+
+
+def server_request(base_url: str, path: str, post: bool = False) -> Dict[str, Any]:
+    request = urllib.request.Request(base_url + path, data=b"{}" if post else None)
+    with urllib.request.urlopen(request) as response:
+        result: Dict[str, Any] = json.load(response)
+        return result
+
+
+def wait_for_server(base_url: str, timeout: float = 10.0) -> None:
+    deadline = time.time() + timeout
+    while True:
+        try:
+            server_request(base_url, "/stats")
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def write_providers(path: str, base_url: str) -> None:
+    providers = {
+        name: {"base_url": base_url, "api_key": "mock", "model_name": f"mock-{name}"}
+        for name in ("player", "interrogator", "judge")
+    }
+    with open(path, "w", encoding="utf-8") as w:
+        json.dump(providers, w, ensure_ascii=False, indent=4)
+
+
+def run_scenario(
+    scenario: str, work_dir: str, language: str, every_x: int, queue: "multiprocessing.Queue[Any]"
+) -> None:
+    # Runs in a fresh process, so CPU time and peak RSS belong to this scenario only
+    from src import run_eval_v1, run_eval_v2, run_judge
+
+    providers_path = os.path.join(work_dir, "providers.json")
+    v2_output_path = os.path.join(work_dir, "eval_v2.json")
+    start_usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            if scenario == "eval_v2":
+                run_eval_v2.run_eval(
+                    providers_path=providers_path,
+                    settings_path="settings_v2.json",
+                    output_path=v2_output_path,
+                    player_name="player",
+                    interrogator_name="interrogator",
+                    judge_name="judge",
+                    language=language,
+                    every_x=every_x,
+                )
+            elif scenario == "judge":
+                run_judge.main(
+                    providers_path=providers_path,
+                    settings_path="settings_v2.json",
+                    input_path=v2_output_path,
+                    output_path=os.path.join(work_dir, "judge.json"),
+                    judge_name="judge",
+                    language=language,
+                )
+            else:
+                assert scenario == "eval_v1", scenario
+                run_eval_v1.run_eval(
+                    providers_path=providers_path,
+                    settings_path="settings_v1.json",
+                    output_path=os.path.join(work_dir, "eval_v1.json"),
+                    testee_name="player",
+                    tester_name="judge",
+                    language=language,
+                    every_x=every_x,
+                )
+    wall_time = time.perf_counter() - start_time
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_time = end_usage.ru_utime - start_usage.ru_utime + end_usage.ru_stime - start_usage.ru_stime
+    queue.put(
+        {
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            # ru_maxrss is in kilobytes on Linux
+            "peak_rss_mb": end_usage.ru_maxrss / 1024,
+        }
+    )
+
+
+def run_benchmark(
+    scenarios: List[str],
+    language: str,
+    every_x: int,
+    server_config: Dict[str, Any],
+) -> List[Dict[str, Any]]:
+    port = get_free_port()
+    base_url = f"http://127.0.0.1:{port}/v1"
+    context = multiprocessing.get_context("spawn")
+    server = context.Process(target=serve, kwargs={"port": port, **server_config}, daemon=True)
+    server.start()
+    rows = []
+    try:
+        wait_for_server(base_url)
+        with tempfile.TemporaryDirectory() as work_dir:
+            write_providers(os.path.join(work_dir, "providers.json"), base_url)
+            for scenario in scenarios:
+                server_request(base_url, "/reset", post=True)
+                queue: "multiprocessing.Queue[Any]" = context.Queue()
+                process = context.Process(
+                    target=run_scenario, args=(scenario, work_dir, language, every_x, queue)
+                )
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    raise RuntimeError(f"Scenario {scenario} failed with code {process.exitcode}")
+                result = queue.get()
+                stats = server_request(base_url, "/stats")
+                calls = sum(stats["calls"].values())
+                rows.append(
+                    {
+                        "scenario": scenario,
+                        "wall_time": result["wall_time"],
+                        "calls": calls,
+                        "errors": stats["errors"],
+                        "calls_per_sec": calls / result["wall_time"],
+                        "cpu_ms_per_call": 1000 * result["cpu_time"] / max(calls, 1),
+                        "peak_rss_mb": result["peak_rss_mb"],
+                    }
+                )
+    finally:
+        server.terminate()
+        server.join()
+    return rows
+
+
+def compare_with_baseline(
+    rows: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float
+) -> List[str]:
+    regressions = []
+    baseline_rows = {row["scenario"]: row for row in baseline}
+    for row in rows:
+        old_row = baseline_rows.get(row["scenario"])
+        if old_row is None:
+            continue
+        for metric in ("cpu_ms_per_call", "peak_rss_mb"):
+            if row[metric] > old_row[metric] * (1.0 + tolerance):
+                regressions.append(
+                    f"{row['scenario']}: {metric} {old_row[metric]:.2f} -> {row[metric]:.2f}"
+                )
+    return regressions
+
+
+def main(
+    scenarios: str = ",".join(SCENARIOS),
+    language: str = "en",
+    every_x: int = 8,
+    latency: str = "fixed",
+    latency_ms: float = 0.0,
+    error_rate: float = 0.0,
+    judge_defect_rate: float = 0.0,
+    player_repeat: int = 4,
+    output_path: Optional[str] = None,
+    baseline_path: Optional[str] = None,
+    tolerance: float = 0.25,
+) -> None:
+    # Note that with error_rate > 0 the runners' own retry sleeps dominate wall time
+    scenario_list = scenarios.split(",") if isinstance(scenarios, str) else list(scenarios)
+    for scenario in scenario_list:
+        assert scenario in SCENARIOS, scenario
+    if "judge" in scenario_list:
+        assert "eval_v2" in scenario_list, "The judge scenario re-judges the eval_v2 output"
+    server_config = {
+        "latency": latency,
+        "latency_ms": latency_ms,
+        "error_rate": error_rate,
+        "judge_defect_rate": judge_defect_rate,
+        "player_repeat": player_repeat,
+    }
+    rows = run_benchmark(scenario_list, language, every_x, server_config)
+    print(tabulate(rows, headers="keys", tablefmt="github", floatfmt=".3f"))
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as w:
+            json.dump({"config": server_config, "rows": rows}, w, ensure_ascii=False, indent=4)
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as r:
+            baseline = json.load(r)["rows"]
+        regressions = compare_with_baseline(rows, baseline, tolerance)
+        for regression in regressions:
+            print("Regression:", regression)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
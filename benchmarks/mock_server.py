@@ -0,0 +1,203 @@
+import re
+import json
+import time
+import random
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+import fire  # type: ignore
+
+
+@dataclass
+class MockConfig:
+    player_text: str = "*smiles* Of course, let me tell you a story about that."
+    player_repeat: int = 4
+    # Latency in milliseconds: "fixed" uses latency_ms, "uniform" draws from
+    # [0, 2 * latency_ms], "lognormal" has median latency_ms and sigma latency_sigma
+    latency: str = "fixed"
+    latency_ms: float = 0.0
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    # Probability that a judge turn entry misses one of its fields
+    judge_defect_rate: float = 0.0
+    seed: int = 42
+
+
+def detect_role(messages: List[Dict[str, Any]]) -> str:
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    if '"next_user_utterance"' in prompt:
+        return "tester"
+    if '"next_utterance"' in prompt:
+        return "interrogator"
+    if '"in_character_score"' in prompt:
+        return "judge"
+    return "player"
+
+
+def get_judged_turns(messages: List[Dict[str, Any]]) -> List[int]:
+    prompt = str(messages[-1].get("content", ""))
+    follow_up = re.search(r"the following turns: ([\d, ]+)", prompt)
+    if follow_up:
+        return [int(turn) for turn in follow_up.group(1).split(",")]
+    conversation = prompt.split("Conversation:")[-1]
+    num_turns = len(re.findall(r"^Turn \d+:", conversation, flags=re.MULTILINE))
+    return list(range(1, max(1, num_turns) + 1))
+
+
+class MockLLM:
+    def __init__(self, config: MockConfig) -> None:
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.errors = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"calls": dict(self.calls), "errors": self.errors}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.calls = {}
+            self.errors = 0
+
+    def sample_latency(self) -> float:
+        config = self.config
+        with self.lock:
+            if config.latency == "uniform":
+                latency_ms = self.rng.uniform(0.0, 2 * config.latency_ms)
+            elif config.latency == "lognormal":
+                latency_ms = config.latency_ms * self.rng.lognormvariate(0.0, config.latency_sigma)
+            else:
+                assert config.latency == "fixed", config.latency
+                latency_ms = config.latency_ms
+        return latency_ms / 1000.0
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            failed = self.rng.random() < self.config.error_rate
+            self.errors += int(failed)
+            return failed
+
+    def complete(self, messages: List[Dict[str, Any]]) -> str:
+        role = detect_role(messages)
+        with self.lock:
+            self.calls[role] = self.calls.get(role, 0) + 1
+            score = self.rng.randint(1, 5)
+        if role == "interrogator":
+            return json.dumps({"next_utterance": "Tell me more about yourself!"})
+        if role == "tester":
+            return json.dumps(
+                {
+                    "next_user_utterance": "Tell me more about yourself!",
+                    "is_refusal_explanation": "The player answers.",
+                    "is_refusal": False,
+                    "stay_in_character_explanation": "I agree that 'Of course' fits.",
+                    "stay_in_character_score": score,
+                    "language_fluency_explanation": "I agree.",
+                    "language_fluency_score": score,
+                    "entertainment_explanation": "I neither agree nor disagree.",
+                    "entertainment_score": score,
+                }
+            )
+        if role == "judge":
+            turn_scores = [
+                {
+                    "turn": turn,
+                    "is_refusal_explanation": "The player answers.",
+                    "is_refusal": False,
+                    "in_character_explanation": "'Of course' fits. I agree.",
+                    "in_character_score": score,
+                    "entertaining_explanation": "I neither agree nor disagree.",
+                    "entertaining_score": score,
+                    "fluency_explanation": "I agree.",
+                    "fluency_score": score,
+                }
+                for turn in get_judged_turns(messages)
+            ]
+            with self.lock:
+                for entry in turn_scores:
+                    if self.rng.random() < self.config.judge_defect_rate:
+                        entry.pop("fluency_score")
+            return json.dumps({"scores": turn_scores}, indent=4)
+        return " ".join([self.config.player_text] * self.config.player_repeat)
+
+
+def make_completion(model: str, contents: List[str]) -> Dict[str, Any]:
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": i,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+            for i, content in enumerate(contents)
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def make_handler(llm: MockLLM) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def _send(self, status: int, body: Dict[str, Any]) -> None:
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/").endswith("/stats"):
+                self._send(200, llm.stats())
+            else:
+                self._send(404, {"error": {"message": "Not found"}})
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if self.path.rstrip("/").endswith("/reset"):
+                llm.reset()
+                self._send(200, llm.stats())
+                return
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "Not found"}})
+                return
+            time.sleep(llm.sample_latency())
+            if llm.should_fail():
+                self._send(500, {"error": {"message": "Mock failure", "type": "server_error"}})
+                return
+            messages = request.get("messages", [])
+            contents = [llm.complete(messages) for _ in range(int(request.get("n") or 1))]
+            self._send(200, make_completion(request.get("model", "mock"), contents))
+
+    return Handler
+
+
+def create_server(
+    config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0
+) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(MockLLM(config or MockConfig())))
+    server.daemon_threads = True
+    return server
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000, **config: Any) -> None:
+    server = create_server(MockConfig(**config), host=host, port=port)
+    print(f"Mock OpenAI-compatible server at http://{host}:{server.server_port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    fire.Fire(serve)
@@ -0,0 +1,126 @@
+import json
+import random
+from typing import Any, Dict, List
+
+from src.data import Character, ChatMessages, Settings, Situation
+
+
+WORDS = (
+    "the player answers with a quote 'yes, of course' and stays close to the character "
+    "description, but the phrasing is sometimes awkward and a few words are repeated"
+).split()
+
+
+def make_text(rng: random.Random, num_words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+
+def make_character(index: int, rng: random.Random) -> Dict[str, Any]:
+    return {
+        "char_name": f"Character {index}",
+        "system_prompt": make_text(rng, 300),
+        "example_prompt": make_text(rng, 100),
+        "initial_message": make_text(rng, 20),
+        "summary": make_text(rng, 10),
+        "tags": ["synthetic"],
+    }
+
+
+def make_situation(index: int, rng: random.Random, num_turns: int = 4) -> Dict[str, Any]:
+    return {"text": f"Situation {index}: " + make_text(rng, 30), "num_turns": num_turns}
+
+
+def make_settings(
+    num_characters: int = 8, num_situations: int = 8, seed: int = 42
+) -> Dict[str, Any]:
+    # Shaped like one language section of settings_v2.json
+    rng = random.Random(seed)
+    return {
+        "characters": [make_character(i, rng) for i in range(num_characters)],
+        "situations": [make_situation(i, rng) for i in range(num_situations)],
+        "version": 2,
+        "interrogator_system_prompt_path": "templates/v2/interrogator_system.jinja",
+        "interrogator_user_prompt_path": "templates/v2/interrogator_user.jinja",
+        "judge_system_prompt_path": "templates/v2/judge_system.jinja",
+        "judge_user_prompt_path": "templates/v2/judge_user.jinja",
+        "character_prompt_path": "templates/en_character.jinja",
+    }
+
+
+def load_settings(num_characters: int = 8, num_situations: int = 8, seed: int = 42) -> Settings:
+    return Settings.from_dict(make_settings(num_characters, num_situations, seed))
+
+
+def make_messages(rng: random.Random, num_turns: int = 4, num_words: int = 60) -> ChatMessages:
+    messages: ChatMessages = []
+    for _ in range(num_turns):
+        messages.append({"role": "user", "content": make_text(rng, num_words // 3)})
+        messages.append({"role": "assistant", "content": make_text(rng, num_words)})
+    return messages
+
+
+def make_turn_scores(turn: int, rng: random.Random, num_words: int = 60) -> Dict[str, Any]:
+    return {
+        "turn": turn,
+        "is_refusal_explanation": make_text(rng, num_words // 3),
+        "is_refusal": False,
+        "in_character_explanation": make_text(rng, num_words),
+        "in_character_score": rng.randint(1, 5),
+        "entertaining_explanation": make_text(rng, num_words),
+        "entertaining_score": rng.randint(1, 5),
+        "fluency_explanation": make_text(rng, num_words),
+        "fluency_score": rng.randint(1, 5),
+    }
+
+
+def make_judge_output(
+    num_turns: int = 4, messy: bool = False, broken: bool = False, seed: int = 42
+) -> str:
+    # A messy output wraps the JSON in prose and uses escaped quotes and non-ASCII text,
+    # a broken one also has stray braces around it and trailing commas inside it
+    rng = random.Random(seed)
+    scores = [make_turn_scores(turn + 1, rng) for turn in range(num_turns)]
+    if not messy:
+        return json.dumps({"scores": scores}, indent=4)
+    for turn_scores in scores:
+        turn_scores["fluency_explanation"] += ' The player said "привет, как дела?" \\ twice.'
+    text = json.dumps({"scores": scores}, indent=4, ensure_ascii=False)
+    if broken:
+        text = text.replace("\n        }", ",\n        }").replace("\n    ]", ",\n    ]")
+        return "Scores for {each turn}:\n" + text + "\nExample: {turn: 1}"
+    return "Here is the evaluation of every turn.\n```json\n" + text + "\n```\nHope this helps!"
+
+
+def make_outputs(num_outputs: int, num_turns: int = 4, seed: int = 42) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    characters = [make_character(i, rng) for i in range(8)]
+    situations = [make_situation(i, rng, num_turns) for i in range(max(1, num_outputs // 8))]
+    outputs = []
+    for i in range(num_outputs):
+        scores: Dict[str, List[int]] = {
+            metric: [rng.randint(1, 5) for _ in range(num_turns)]
+            for metric in ("in_character", "entertaining", "fluency")
+        }
+        scores["is_refusal"] = [int(rng.random() < 0.05) for _ in range(num_turns)]
+        outputs.append(
+            {
+                "messages": make_messages(rng, num_turns),
+                "character": Character.from_dict(characters[i % len(characters)]).to_dict(),
+                "situation": Situation.from_dict(
+                    situations[(i // len(characters)) % len(situations)]
+                ).to_dict(),
+                "scores": scores,
+            }
+        )
+    return outputs
+
+
+def make_result(num_outputs: int, seed: int = 42) -> Dict[str, Any]:
+    provider = {"model_name": "synthetic", "system_prompt": "", "params": {}}
+    return {
+        "outputs": make_outputs(num_outputs, seed=seed),
+        "version": 2,
+        "judge": {**provider, "model_name": "synthetic-judge"},
+        "interrogator": {**provider, "model_name": "synthetic-interrogator"},
+        "player": {**provider, "model_name": "synthetic-player"},
+    }
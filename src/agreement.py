@@ -0,0 +1,110 @@
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+from scipy.stats import spearmanr, kendalltau  # type: ignore
+
+
+FloatArray = npt.NDArray[np.float64]
+
+
+def item_coincidences(ratings: FloatArray) -> Tuple[FloatArray, FloatArray]:
+    # ratings: (annotators, items), NaN for missing
+    # returns distinct values (V,) and per-item coincidence matrices (items, V, V)
+    values = np.unique(ratings[~np.isnan(ratings)])
+    counts = np.stack([(ratings == v).sum(axis=0) for v in values], axis=1).astype(np.float64)
+    pairable = counts.sum(axis=1)
+    counts[pairable < 2] = 0.0
+    pairable[pairable < 2] = np.inf
+    coincidences = counts[:, :, None] * counts[:, None, :]
+    coincidences -= counts[:, :, None] * np.eye(len(values))[None, :, :]
+    coincidences /= (pairable - 1)[:, None, None]
+    return values, coincidences
+
+
+def distance_matrix(values: FloatArray, marginals: FloatArray, level: str) -> FloatArray:
+    # marginals: (B, V), returns squared distances (B, V, V)
+    if level == "interval":
+        diff = values[:, None] - values[None, :]
+        return np.broadcast_to(diff**2, (len(marginals), len(values), len(values))).copy()
+    assert level == "ordinal", level
+    size = len(values)
+    lo = np.minimum.outer(np.arange(size), np.arange(size))
+    hi = np.maximum.outer(np.arange(size), np.arange(size))
+    cumulative = np.cumsum(marginals, axis=1)
+    between = cumulative[:, hi] - cumulative[:, lo] + marginals[:, lo]
+    delta = between - (marginals[:, lo] + marginals[:, hi]) / 2
+    result: FloatArray = delta**2
+    return result
+
+
+def alpha_from_coincidences(
+    values: FloatArray, coincidences: FloatArray, level: str = "ordinal"
+) -> FloatArray:
+    # coincidences: (B, V, V), one alpha per matrix
+    marginals = coincidences.sum(axis=2)
+    total = marginals.sum(axis=1)
+    distances = distance_matrix(values, marginals, level)
+    observed = (coincidences * distances).sum(axis=(1, 2))
+    expected = (marginals[:, :, None] * marginals[:, None, :] * distances).sum(axis=(1, 2))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result: FloatArray = 1.0 - (total - 1) * observed / expected
+    return result
+
+
+def krippendorff_alpha(ratings: FloatArray, level: str = "ordinal") -> float:
+    values, coincidences = item_coincidences(ratings)
+    return float(alpha_from_coincidences(values, coincidences.sum(axis=0)[None], level)[0])
+
+
+def bootstrap_alpha(
+    ratings: FloatArray,
+    level: str = "ordinal",
+    n_bootstrap: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+) -> Tuple[float, float, float]:
+    rng = rng if rng is not None else np.random.default_rng()
+    values, coincidences = item_coincidences(ratings)
+    num_items = coincidences.shape[0]
+    # Resample items: every bootstrap coincidence matrix is a weighted sum of item matrices
+    weights = rng.multinomial(num_items, np.full(num_items, 1.0 / num_items), size=n_bootstrap)
+    flat = coincidences.reshape(num_items, -1)
+    sampled = (weights.astype(np.float64) @ flat).reshape(n_bootstrap, len(values), len(values))
+    alphas = alpha_from_coincidences(values, sampled, level)
+    point = float(alpha_from_coincidences(values, coincidences.sum(axis=0)[None], level)[0])
+    ci_lower, ci_upper = np.nanpercentile(alphas, [2.5, 97.5])
+    return point, float(ci_lower), float(ci_upper)
+
+
+def pairwise_correlations(
+    ratings: FloatArray, min_overlap: int = 3
+) -> Dict[Tuple[int, int], Tuple[float, float, int]]:
+    # (annotator_i, annotator_j) -> (spearman, kendall, number of shared items)
+    observed = ~np.isnan(ratings)
+    overlaps = observed.astype(np.int64) @ observed.T.astype(np.int64)
+    results = dict()
+    for i, j in combinations(range(ratings.shape[0]), 2):
+        if overlaps[i, j] < min_overlap:
+            continue
+        mask = observed[i] & observed[j]
+        spearman = spearmanr(ratings[i, mask], ratings[j, mask])[0]
+        kendall = kendalltau(ratings[i, mask], ratings[j, mask]).statistic
+        results[(i, j)] = (float(spearman), float(kendall), int(overlaps[i, j]))
+    return results
+
+
+def build_rating_matrix(
+    annotator_ratings: Dict[str, Dict[str, Dict[str, float]]], criteria: List[str]
+) -> Tuple[List[str], List[str], FloatArray]:
+    # annotator -> item -> criterion -> score, into (criteria, annotators, items) with NaN holes
+    annotators = sorted(annotator_ratings.keys())
+    items = sorted({item for ratings in annotator_ratings.values() for item in ratings})
+    item_index = {item: i for i, item in enumerate(items)}
+    matrix = np.full((len(criteria), len(annotators), len(items)), np.nan, dtype=np.float64)
+    for a, annotator in enumerate(annotators):
+        for item, scores in annotator_ratings[annotator].items():
+            for c, criterion in enumerate(criteria):
+                if criterion in scores:
+                    matrix[c, a, item_index[item]] = scores[criterion]
+    return annotators, items, matrix
@@ -5,6 +5,8 @@ from typing import Dict, List
 from collections import defaultdict
 from statistics import mean
 
+from src.data import get_dialogue_id
+
 
 def main(input_dir: str, output_path: str) -> None:
 
@@ -16,10 +18,11 @@ def main(input_dir: str, output_path: str) -> None:
         with open(os.path.join(input_dir, f)) as r:
             for line in r:
                 record = json.loads(line)
-                messages = str(record["messages"])
-                records[messages] = record
+                dialogue_id = get_dialogue_id(record)
+                record["dialogue_id"] = dialogue_id
+                records[dialogue_id] = record
                 for k, v in record["human_scores"].items():
-                    scores[messages][k].append(v)
+                    scores[dialogue_id][k].append(v)
 
     with open(output_path, "w") as w:
         for key, record in records.items():
@@ -0,0 +1,126 @@
+import os
+import json
+import random
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple, Optional, Sequence, Union
+
+import fire  # type: ignore
+
+from src.data import get_dialogue_id
+from src.result_format import list_result_files, load_result
+from src.score_index import load_score_index
+
+
+Stratum = Tuple[str, ...]
+# A (player, character, situation) triple has a single dialogue, so strata are coarser
+STRATIFY_FIELDS = {"player": ("players",), "pair": ("characters", "situations")}
+
+
+def _as_list(value: Union[str, Sequence[str], None]) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [v for v in value.split(",") if v]
+    return list(value)
+
+
+def load_annotated_ids(annotations_dirs: List[str]) -> Set[str]:
+    annotated = set()
+    for annotations_dir in annotations_dirs:
+        for file_name in os.listdir(annotations_dir):
+            if not file_name.endswith(".jsonl"):
+                continue
+            with open(os.path.join(annotations_dir, file_name), encoding="utf-8") as r:
+                for line in r:
+                    if line.strip():
+                        annotated.add(get_dialogue_id(json.loads(line)))
+    return annotated
+
+
+def collect_candidates(
+    input_dirs: List[str], annotated: Set[str], stratify: str = "player"
+) -> Dict[Stratum, Dict[str, str]]:
+    # stratum -> dialogue ID -> result file, one file per dialogue even if judged several times
+    fields = STRATIFY_FIELDS[stratify]
+    strata: Dict[Stratum, Dict[str, str]] = defaultdict(dict)
+    for input_dir in input_dirs:
+        for file_name in list_result_files(input_dir):
+            file_path = os.path.join(input_dir, file_name)
+            index = load_score_index(file_path)
+            for i, dialogue_id in enumerate(index.keys.tolist()):
+                if dialogue_id in annotated:
+                    continue
+                stratum = tuple(str(getattr(index, field)[i]) for field in fields)
+                strata[stratum].setdefault(dialogue_id, file_path)
+    return strata
+
+
+def sample_balanced(
+    strata: Dict[Stratum, Dict[str, str]], budget: int, rng: random.Random
+) -> List[Tuple[str, str]]:
+    queues = []
+    for stratum in sorted(strata.keys()):
+        items = sorted(strata[stratum].items())
+        rng.shuffle(items)
+        queues.append(items)
+    rng.shuffle(queues)
+
+    # Round-robin over strata, so every stratum gets one item before any gets a second
+    selected: List[Tuple[str, str]] = []
+    while len(selected) < budget and any(queues):
+        for queue in queues:
+            if queue and len(selected) < budget:
+                selected.append(queue.pop())
+    return selected
+
+
+def main(
+    input_dirs: Union[str, Sequence[str]],
+    output_dir: str,
+    budget: int,
+    annotations_dirs: Union[str, Sequence[str], None] = None,
+    num_annotators: int = 1,
+    overlap: int = 1,
+    seed: int = 42,
+    stratify: str = "player",
+) -> None:
+    assert 1 <= overlap <= num_annotators
+    assert stratify in STRATIFY_FIELDS, stratify
+    rng = random.Random(seed)
+    annotated = load_annotated_ids(_as_list(annotations_dirs))
+    strata = collect_candidates(_as_list(input_dirs), annotated, stratify=stratify)
+    selected = sample_balanced(strata, budget=budget, rng=rng)
+    print(f"Strata: {len(strata)}, already annotated: {len(annotated)}, selected: {len(selected)}")
+
+    file2ids: Dict[str, Set[str]] = defaultdict(set)
+    for dialogue_id, file_path in selected:
+        file2ids[file_path].add(dialogue_id)
+
+    order = {dialogue_id: i for i, (dialogue_id, _) in enumerate(selected)}
+    shards: List[List[Tuple[int, str]]] = [[] for _ in range(num_annotators)]
+    for file_path, ids in file2ids.items():
+        data = load_result(file_path)
+        player_name: Optional[str] = (data.get("player") or dict()).get("model_name")
+        for output in data["outputs"]:
+            dialogue_id = get_dialogue_id(output, player_name)
+            if dialogue_id not in ids:
+                continue
+            ids.remove(dialogue_id)
+            output["dialogue_id"] = dialogue_id
+            output.setdefault("player", data.get("player"))
+            line = json.dumps(output, ensure_ascii=False) + "\n"
+            position = order[dialogue_id]
+            for shift in range(overlap):
+                shards[(position + shift) % num_annotators].append((position, line))
+
+    os.makedirs(output_dir, exist_ok=True)
+    for annotator, shard in enumerate(shards):
+        shard.sort()
+        with open(os.path.join(output_dir, f"annotator_{annotator}.jsonl"), "w", encoding="utf-8") as w:
+            for _, line in shard:
+                w.write(line)
+        print(f"annotator_{annotator}: {len(shard)} dialogues")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -1,9 +1,9 @@
-import json
 import sys
-import shutil
-from typing import Dict, Any, Type, Optional, cast
+import threading
+from typing import Dict, Any, Type, Optional, Tuple, cast
 
 from textual import on, events, work
+from textual.worker import get_current_worker
 from textual.app import App, ComposeResult
 from textual.binding import Binding
 from textual.widgets import (
@@ -22,6 +22,8 @@ from textual.validation import Number
 from textual.containers import Container, Grid, Vertical
 from textual.screen import ModalScreen
 
+from src.record_store import JsonlRecordStore
+
 
 def to_markdown(record: Dict[str, Any]) -> str:
     result = ""
@@ -129,12 +131,14 @@ class Browser(App[None]):
         ("r", "rate", "Rate"),
         Binding("g", "go", "Go", show=False, priority=True),
     ]
+    PREFETCH_SIZE = 3
 
     def compose(self) -> ComposeResult:
         self.path = sys.argv[1]
         self.current_idx = 0
-        with open(sys.argv[1]) as r:
-            self.records = [json.loads(line) for line in r]
+        self.records = JsonlRecordStore(self.path)
+        self.rendered: Dict[int, Tuple[str, str]] = dict()
+        self.rendered_lock = threading.Lock()
         yield Header()
         yield Static("", id="meta")
         yield Container(MarkdownViewer(), Static("Loading...", id="loading"), id="main-content")
@@ -183,9 +187,10 @@ class Browser(App[None]):
         self.markdown_viewer.display = False
         self.loading_indicator.display = True
 
-        record = self.records[self.current_idx]
-        self.meta_info.update(to_meta(record))
-        await self.markdown_viewer.document.update(to_markdown(record))
+        markdown, meta = self.get_rendered(self.current_idx)
+        self.meta_info.update(meta)
+        await self.markdown_viewer.document.update(markdown)
+        self.prefetch(self.current_idx)
         self.counter.update(f"Record {self.current_idx + 1} of {len(self.records)}")
 
         def show_markdown() -> None:
@@ -195,6 +200,39 @@ class Browser(App[None]):
 
         self.markdown_viewer.scroll_home(animate=False, on_complete=show_markdown)
 
+    def get_rendered(self, position: int) -> Tuple[str, str]:
+        line = self.records.get_line(position)
+        with self.rendered_lock:
+            if line in self.rendered:
+                return self.rendered[line]
+        record = self.records.get_record(line)
+        rendered = (to_markdown(record), to_meta(record))
+        with self.rendered_lock:
+            self.rendered[line] = rendered
+        return rendered
+
+    @work(thread=True, exclusive=True, group="prefetch", exit_on_error=False)
+    def prefetch(self, position: int) -> None:
+        worker = get_current_worker()
+        lines = set()
+        try:
+            lines.add(self.records.get_line(position))
+            for shift in range(1, self.PREFETCH_SIZE + 1):
+                for step in (shift, -shift):
+                    if worker.is_cancelled:
+                        return
+                    # Records can be deleted meanwhile, so wrap around the current size
+                    neighbour = (position + step) % len(self.records)
+                    self.get_rendered(neighbour)
+                    lines.add(self.records.get_line(neighbour))
+        except (IndexError, ZeroDivisionError):
+            # The store shrank under this worker, showing the next record restarts it
+            return
+        with self.rendered_lock:
+            for line in list(self.rendered.keys()):
+                if line not in lines:
+                    self.rendered.pop(line)
+
     async def on_mount(self) -> None:
         self.loading_indicator.display = False
         await self.show_record()
@@ -232,7 +270,7 @@ class Browser(App[None]):
 
     async def action_delete(self) -> None:
         assert 0 <= self.current_idx < len(self.records)
-        self.records.pop(self.current_idx)
+        self.records.delete(self.current_idx)
         if self.current_idx >= len(self.records):
             self.current_idx = 0
         await self.show_record()
@@ -255,10 +293,9 @@ class Browser(App[None]):
             self.input.value = event.key
 
     def action_save(self) -> None:
-        with open(self.path + "_tmp", "w") as w:
-            for record in self.records:
-                w.write(json.dumps(record, ensure_ascii=False) + "\n")
-        shutil.move(self.path + "_tmp", self.path)
+        self.records.compact()
+        with self.rendered_lock:
+            self.rendered.clear()
         self.notify("Saved!")
 
     @work
@@ -267,9 +304,10 @@ class Browser(App[None]):
         is_ok = await self.push_screen_wait(screen)
         if is_ok:
             ratings = screen.get_ratings()
-            record = self.records[self.current_idx]
-            record["human_scores"] = ratings
-            self.meta_info.update(to_meta(record))
+            self.records.update(self.current_idx, {"human_scores": ratings})
+            with self.rendered_lock:
+                self.rendered.pop(self.records.get_line(self.current_idx), None)
+            self.meta_info.update(self.get_rendered(self.current_idx)[1])
             self.notify("Scores updated!")
 
 
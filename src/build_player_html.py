@@ -1,26 +1,61 @@
+import os
 import json
 import html
 import base64
+import hashlib
 import math
 from statistics import mean
 from typing import List, Dict, Any, Union, Optional
 
 import fire  # type: ignore
 
+from src.result_format import load_result
 from src.util import encode_prompt
 
 
-def generate_html(data: Dict[str, Any], template_path: str = "templates/player_page.jinja") -> str:
+def get_shard_name(key: str) -> str:
+    # Base64 keys can contain "/" and exceed file name limits, so shards are named by a hash
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".json"
+
+
+def get_output_score(output: Dict[str, Any]) -> Optional[float]:
+    assert "scores" in output
+    example_scores = output["scores"]
+    is_refusal = False
+    if "is_refusal" in example_scores and max(example_scores["is_refusal"]) == 1:
+        is_refusal = True
+    if "has_refusal" in output and output["has_refusal"]:
+        is_refusal = True
+    if is_refusal:
+        return None
+    return float(
+        mean(
+            [
+                mean(example_scores.get("stay_in_character", example_scores.get("in_character", []))),
+                mean(example_scores.get("language_fluency", example_scores.get("fluency", []))),
+                mean(example_scores.get("entertainment", example_scores.get("entertaining", []))),
+            ]
+        )
+    )
+
+
+def generate_html(
+    data: Dict[str, Any],
+    template_path: str = "templates/player_page.jinja",
+    shards_path: Optional[str] = None,
+    shards_url: Optional[str] = None,
+) -> str:
     characters: List[str] = sorted(set(o["character"]["char_name"] for o in data["outputs"]))
     situations: List[str] = sorted(set(o["situation"]["text"] for o in data["outputs"]))
     keys: Dict[str, Dict[str, str]] = {situation: {} for situation in situations}
-    grouped_outputs: Dict[str, Dict[str, Dict[str, Any]]] = {
+    # With several samples per pair a cell averages them and its dialog lists all of them
+    grouped_outputs: Dict[str, Dict[str, List[Dict[str, Any]]]] = {
         situation: {} for situation in situations
     }
-    for output in data["outputs"]:
+    for output in sorted(data["outputs"], key=lambda o: int(o.get("sample", 0))):
         situation = output["situation"]["text"]
         char_name = output["character"]["char_name"]
-        grouped_outputs[situation][char_name] = output
+        grouped_outputs[situation].setdefault(char_name, []).append(output)
 
     scores: Dict[str, Dict[str, Optional[float]]] = {
         situation: {char: None for char in characters} for situation in situations
@@ -28,42 +63,18 @@ def generate_html(data: Dict[str, Any], template_path: str = "templates/player_p
     dialogs: Dict[str, Any] = {}
 
     for situation, char_outputs in grouped_outputs.items():
-        for char_name, output in char_outputs.items():
-            assert "scores" in output
-            example_scores = output["scores"]
-            is_refusal = False
-            if "is_refusal" in example_scores and max(example_scores["is_refusal"]) == 1:
-                is_refusal = True
-            if "has_refusal" in output and output["has_refusal"]:
-                is_refusal = True
-            if is_refusal:
-                scores[situation][char_name] = None
-            else:
-                scores[situation][char_name] = mean(
-                    [
-                        mean(
-                            example_scores.get(
-                                "stay_in_character", example_scores.get("in_character", [])
-                            )
-                        ),
-                        mean(
-                            example_scores.get(
-                                "language_fluency", example_scores.get("fluency", [])
-                            )
-                        ),
-                        mean(
-                            example_scores.get(
-                                "entertainment", example_scores.get("entertaining", [])
-                            )
-                        ),
-                    ]
-                )
+        for char_name, outputs in char_outputs.items():
+            sample_scores = [get_output_score(output) for output in outputs]
+            valid_scores = [score for score in sample_scores if score is not None]
+            scores[situation][char_name] = mean(valid_scores) if valid_scores else None
             key = base64.b64encode(f"{char_name}::{situation}".encode("utf-8")).decode("utf-8")
             dialogs[key] = {
-                "messages": output["messages"],
                 "character": char_name,
                 "situation": situation,
-                "scores": example_scores,
+                "samples": [
+                    {"messages": output["messages"], "scores": output["scores"]}
+                    for output in outputs
+                ],
             }
             keys[situation][char_name] = key
 
@@ -89,6 +100,17 @@ def generate_html(data: Dict[str, Any], template_path: str = "templates/player_p
             overall_scores.append(char_average)
     overall_average = mean(overall_scores) if overall_scores else None
 
+    # Dialogs are either inlined or written as separate shards fetched on click
+    shards: Dict[str, str] = dict()
+    if shards_path is not None:
+        os.makedirs(shards_path, exist_ok=True)
+        for key, dialog in dialogs.items():
+            shard_name = get_shard_name(key)
+            with open(os.path.join(shards_path, shard_name), "w", encoding="utf-8") as w:
+                json.dump(dialog, w, ensure_ascii=False)
+            shards[key] = f"{shards_url}/{shard_name}" if shards_url else shard_name
+        dialogs = dict()
+
     html_content = encode_prompt(
         template_path,
         characters=characters,
@@ -102,6 +124,7 @@ def generate_html(data: Dict[str, Any], template_path: str = "templates/player_p
         character_averages=character_averages,
         overall_average=overall_average,
         dialogs=json.dumps(dialogs),
+        shards=json.dumps(shards),
     )
     return html_content
 
@@ -109,13 +132,17 @@ def generate_html(data: Dict[str, Any], template_path: str = "templates/player_p
 def run_build_html(
     json_path: str,
     output_path: str,
+    shards_path: Optional[str] = None,
 ) -> None:
     # Load JSON data
-    with open(json_path, "r", encoding="utf-8") as file:
-        data = json.load(file)
+    data = load_result(json_path)
 
     # Generate HTML
-    html_output = generate_html(data)
+    shards_url = None
+    if shards_path:
+        output_dir = os.path.dirname(os.path.abspath(output_path))
+        shards_url = os.path.relpath(os.path.abspath(shards_path), output_dir)
+    html_output = generate_html(data, shards_path=shards_path, shards_url=shards_url)
 
     # Write HTML to file
     with open(output_path, "w", encoding="utf-8") as file:
@@ -1,4 +1,6 @@
 import os
+import zlib
+import shutil
 import fire  # type: ignore
 import json
 from typing import Optional, List, Dict, Any, Set, Tuple
@@ -6,13 +8,19 @@ from pathlib import Path
 from datetime import datetime
 from statistics import mean, median
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import pandas as pd  # type: ignore
 from tabulate import tabulate
 import numpy as np
+import numpy.typing as npt
 from git import Repo
 
 from src.build_player_html import generate_html
+from src.judge_weights import load_judge_weights
+from src.result_format import list_result_files, load_result, strip_result_suffix
+from src.score_index import load_score_index
+from src.util import get_template
 
 
 SELECTOR_CODE = """
@@ -85,14 +93,27 @@ def display_str(text: str) -> str:
     return text.replace("_", " ").capitalize()
 
 
-def bootstrap_mean(data: List[float], n_bootstrap: int = 1000) -> Tuple[float, float, float]:
-    means = []
-    for _ in range(n_bootstrap):
-        sample = np.random.choice(data, size=len(data), replace=True)
-        means.append(np.mean(sample))
-    point_estimate = np.mean(means)
+def bootstrap_indices(
+    size: int, n_bootstrap: int = 1000, rng: Optional[np.random.Generator] = None
+) -> npt.NDArray[np.int64]:
+    rng = rng if rng is not None else np.random.default_rng()
+    return rng.integers(0, size, size=(n_bootstrap, size))
+
+
+def bootstrap_mean(
+    data: List[float],
+    n_bootstrap: int = 1000,
+    indices: Optional[npt.NDArray[np.int64]] = None,
+    rng: Optional[np.random.Generator] = None,
+) -> Tuple[float, float, float]:
+    values = np.asarray(data, dtype=np.float64)
+    if indices is None:
+        indices = bootstrap_indices(len(values), n_bootstrap=n_bootstrap, rng=rng)
+    assert indices.shape[1] == len(values)
+    means = values[indices].mean(axis=1)
+    point_estimate = float(means.mean())
     ci_lower, ci_upper = np.percentile(means, [2.5, 97.5])
-    return point_estimate, ci_lower, ci_upper
+    return point_estimate, float(ci_lower), float(ci_upper)
 
 
 def get_last_commit_info() -> Dict[str, Any]:
@@ -104,121 +125,311 @@ def get_last_commit_info() -> Dict[str, Any]:
     }
 
 
-def build_table(
-    results_dir: str, output_path: Optional[str] = None, dialogues_path: Optional[str] = None
-) -> None:
-    results_dir = results_dir.rstrip("/").lstrip("/")
+JUDGE_MODEL_MAPPING = {"gpt-4o-2024-08-06": "gpt-4o"}
+MODEL_WEIGHTS = {"claude-3-5-sonnet-20240620": 1.0, "gpt-4o": 1.0}
+METRIC_HEADER = ("in_character", "entertaining", "fluency")
+METRIC_WEIGHTS = [
+    (0.333, 0.333, 0.333),
+    (0.25, 0.5, 0.25),
+    (0.5, 0.25, 0.25),
+    (0.25, 0.25, 0.5),
+]
+MANIFEST_VERSION = 3
+PLAYER_TEMPLATE_PATH = "templates/player_page.jinja"
 
-    judge_model_mapping = {"gpt-4o-2024-08-06": "gpt-4o"}
-    all_scores: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(lambda: defaultdict(dict))
-    player_scores: Dict[str, List[Any]] = defaultdict(list)
-    player_dialogs: Dict[str, Dict[str, Any]] = defaultdict(dict)
-    player_refusals: Dict[str, Set[str]] = defaultdict(set)
-    player2shortname = dict()
-    for file_name in os.listdir(results_dir):
-        if not file_name.endswith(".json"):
-            continue
-        file_path = Path(os.path.join(results_dir, file_name))
-        with open(file_path, encoding="utf-8") as r:
-            data = json.load(r)
-        for output in data["outputs"]:
-            player = data["player"]
-            player_name = player["model_name"]
-            player2shortname[player_name] = (
-                file_name.split("player")[-1].replace(".json", "").strip("_")
-            )
-            player_dialogs[player_name][str(output["messages"])] = output["messages"]
-            judge = data["judge"]
-            judge_name = judge["model_name"]
-            judge_name = judge_model_mapping.get(judge_name, judge_name)
-            scores = output["scores"]
-            output["player"] = player
-            output["judge"] = judge
-            output["interrogator"] = data["interrogator"]
-            is_refusal = scores["is_refusal"]
-            player_scores[player_name].append(output)
-            if max(is_refusal) == 1:
-                player_refusals[player_name].add(str(output["messages"]))
+
+def get_file_fingerprint(file_path: str) -> Dict[str, int]:
+    stat = os.stat(file_path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def get_player_rng(player_name: str, seed: int) -> np.random.Generator:
+    # Seeded per player, so a player's intervals do not depend on which other players exist
+    return np.random.default_rng([seed, zlib.crc32(player_name.encode("utf-8"))])
+
+
+def collect_player_scores(
+    file_paths: List[str], model_weights: Dict[str, float]
+) -> Tuple[Dict[str, Any], Dict[str, List[float]]]:
+    all_scores: Dict[str, Dict[str, Dict[str, float]]] = defaultdict(dict)
+    lengths: Dict[str, Tuple[int, int]] = dict()
+    pairs: Dict[str, Tuple[str, str]] = dict()
+    refusals: Set[str] = set()
+    for file_path in file_paths:
+        index = load_score_index(file_path)
+        judge_name = index.meta["judge"]["model_name"]
+        judge_name = JUDGE_MODEL_MAPPING.get(judge_name, judge_name)
+        is_refusal = index.refusals()
+        metric_scores = {
+            metric: index.mean_scores(metric) for metric in index.metrics() if "refusal" not in metric
+        }
+        for i, key in enumerate(index.keys.tolist()):
+            lengths[key] = (int(index.assistant_chars[i]), int(index.assistant_turns[i]))
+            pairs[key] = (str(index.characters[i]), str(index.situations[i]))
+            if is_refusal[i]:
+                refusals.add(key)
                 continue
-            key = str(output["messages"])
-            all_scores[key][judge_name] = output
-
-    model_weights = {"claude-3-5-sonnet-20240620": 1.0, "gpt-4o": 1.0}
-    metric_header = ("in_character", "entertaining", "fluency")
-    metric_weights = [
-        (0.333, 0.333, 0.333),
-        (0.25, 0.5, 0.25),
-        (0.5, 0.25, 0.25),
-        (0.25, 0.25, 0.5),
-    ]
-    default_weight_signature = "_".join(map(str, metric_weights[0]))
+            all_scores[key][judge_name] = {metric: float(v[i]) for metric, v in metric_scores.items()}
 
-    final_scores: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
-    for _, example_scores in all_scores.items():
+    pair_scores: Dict[Tuple[str, str], Dict[str, List[float]]] = defaultdict(
+        lambda: defaultdict(list)
+    )
+    for example_key, example_scores in all_scores.items():
         example_judge_scores: Dict[str, Dict[str, Any]] = defaultdict(dict)
-        player_name = None
-        for judge_model, output in example_scores.items():
-            player_name = output["player"]["model_name"]
-            judge_scores = output["scores"]
-            output_scores = dict()
-            for key, value in judge_scores.items():
-                if "refusal" in key:
-                    continue
-                score = mean(value)
+        for judge_model, output_scores in example_scores.items():
+            for key, score in output_scores.items():
                 example_judge_scores[key][judge_model] = score
-                output_scores[key] = score
-            for metric_weight in metric_weights:
+            for metric_weight in METRIC_WEIGHTS:
                 metric_weight_signature = "_".join(map(str, metric_weight))
-                merged_metric_weight = dict(zip(metric_header, metric_weight))
+                merged_metric_weight = dict(zip(METRIC_HEADER, metric_weight))
                 final_score = sum([merged_metric_weight[k] * v for k, v in output_scores.items()])
                 example_judge_scores[f"final_{metric_weight_signature}"][judge_model] = final_score
         for key, scores in example_judge_scores.items():
-            final_score = mean([model_weights[k] * v for k, v in scores.items()])
-            final_scores[player_name][key].append(final_score)
+            total_weight = sum([model_weights[k] for k in scores])
+            final_score = sum([model_weights[k] * v for k, v in scores.items()]) / total_weight
+            pair_scores[pairs[example_key]][key].append(final_score)
+
+    # Samples of a pair are averaged, so bootstrap still resamples pairs
+    final_scores: Dict[str, List[float]] = defaultdict(list)
+    for sample_scores in pair_scores.values():
+        for key, values in sample_scores.items():
+            final_scores[key].append(float(np.mean(values)))
+
+    stats = {
+        "num_situations": len(set(pairs.values())),
+        "avg_length": int(sum(c for c, _ in lengths.values()) / sum(t for _, t in lengths.values())),
+        "refusal_ratio": len(refusals) / len(lengths),
+    }
+    final_key = "final_" + "_".join(map(str, METRIC_WEIGHTS[0]))
+    variances = [
+        float(np.var(s[final_key], ddof=1))
+        for s in pair_scores.values()
+        if len(s[final_key]) > 1
+    ]
+    if variances:
+        # Sampling noise of one dialogue, to compare with the differences between players
+        stats["within_pair_sd"] = float(np.sqrt(np.mean(variances)))
+    return stats, dict(final_scores)
+
+
+def compute_player_row(
+    player_name: str,
+    key_scores: Dict[str, List[float]],
+    n_bootstrap: int,
+    seed: int,
+) -> Dict[str, float]:
+    row: Dict[str, float] = dict()
+    num_examples = len(next(iter(key_scores.values())))
+    # One resampling matrix per player, shared by all metrics and weight sets
+    indices = bootstrap_indices(
+        num_examples, n_bootstrap=n_bootstrap, rng=get_player_rng(player_name, seed)
+    )
+    for k, s in key_scores.items():
+        m, ci_lower, ci_upper = bootstrap_mean(s, indices=indices)
+        row[k] = m
+        row[k + "_ci_width"] = (ci_upper - ci_lower) / 2
+    return row
+
+
+def load_manifest(manifest_path: Optional[str], params: Dict[str, Any]) -> Dict[str, Any]:
+    empty_manifest: Dict[str, Any] = {
+        "params": params,
+        "files": dict(),
+        "players": dict(),
+        "pages": list(),
+    }
+    if not manifest_path or not os.path.exists(manifest_path):
+        return empty_manifest
+    with open(manifest_path, encoding="utf-8") as r:
+        manifest: Dict[str, Any] = json.load(r)
+    if manifest.get("params") != params:
+        # Cached players are dropped, but pages written before are still cleaned up
+        return {**empty_manifest, "pages": manifest.get("pages", [])}
+    return manifest
+
+
+def save_manifest(manifest_path: str, manifest: Dict[str, Any]) -> None:
+    tmp_path = manifest_path + "_tmp"
+    with open(tmp_path, "w", encoding="utf-8") as w:
+        json.dump(manifest, w, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
 
+
+def render_player_page(
+    output_path: str,
+    file_paths: List[str],
+    player2shortname: Dict[str, str],
+    lazy_dialogues: bool = True,
+) -> None:
+    judge2records = defaultdict(list)
+    for file_path in file_paths:
+        data = load_result(file_path)
+        for output in data["outputs"]:
+            output["player"] = data["player"]
+            output["judge"] = data["judge"]
+            output["interrogator"] = data["interrogator"]
+            judge2records[data["judge"]["model_name"]].append(output)
+    name = os.path.splitext(os.path.basename(output_path))[0]
+    player_shards_path = os.path.join(os.path.dirname(output_path), name)
+    # Shards of an earlier build are removed in both modes, inlined pages don't use them
+    if os.path.exists(player_shards_path):
+        shutil.rmtree(player_shards_path)
+    html = "---\nlayout: default\n---\n"
+    for _, records in sorted(judge2records.items()):
+        player = records[0]["player"]
+        player["short_name"] = player2shortname[player["model_name"]]
+        judge = records[0]["judge"]
+        judge_full_name = JUDGE_MODEL_MAPPING.get(judge["model_name"], judge["model_name"])
+        judge["short_name"] = player2shortname[judge_full_name]
+        shards_path = None
+        shards_url = None
+        if lazy_dialogues:
+            shards_path = os.path.join(player_shards_path, judge["short_name"])
+            shards_url = f"{name}/{judge['short_name']}"
+        html += generate_html(
+            {
+                "outputs": records,
+                "player": records[0]["player"],
+                "judge": records[0]["judge"],
+                "interrogator": records[0]["interrogator"],
+            },
+            template_path=PLAYER_TEMPLATE_PATH,
+            shards_path=shards_path,
+            shards_url=shards_url,
+        )
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(html)
+
+
+def build_table(
+    results_dir: str,
+    output_path: Optional[str] = None,
+    dialogues_path: Optional[str] = None,
+    n_bootstrap: int = 1000,
+    seed: int = 42,
+    manifest_path: Optional[str] = None,
+    jobs: int = 1,
+    lazy_dialogues: bool = True,
+    judge_weighting: str = "fixed",
+    judge_weights_cache: Optional[str] = None,
+) -> None:
+    results_dir = results_dir.rstrip("/").lstrip("/")
+    if manifest_path:
+        manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+        is_inside = os.path.samefile(manifest_dir, results_dir)
+        assert not is_inside, f"{manifest_path} would be read as a result file of {results_dir}"
+
+    model_weights = MODEL_WEIGHTS
+    if judge_weighting == "pagerank":
+        result_paths = [os.path.join(results_dir, f) for f in list_result_files(results_dir)]
+        model_weights = load_judge_weights(
+            result_paths, cache_path=judge_weights_cache, judge_mapping=JUDGE_MODEL_MAPPING
+        )
+        print("Judge weights:", model_weights)
+    else:
+        assert judge_weighting == "fixed", judge_weighting
+
+    params = {
+        "version": MANIFEST_VERSION,
+        "n_bootstrap": n_bootstrap,
+        "seed": seed,
+        "model_weights": model_weights,
+        # Pages are rendered differently, so switching the mode re-renders every player
+        "lazy_dialogues": lazy_dialogues,
+    }
+    manifest = load_manifest(manifest_path, params)
+    old_files: Dict[str, Dict[str, Any]] = manifest["files"]
+    new_files: Dict[str, Dict[str, Any]] = dict()
+    dirty_players: Set[str] = set()
+    player_files: Dict[str, List[str]] = defaultdict(list)
+    player2shortname = dict()
+    for file_name in list_result_files(results_dir):
+        file_path = os.path.join(results_dir, file_name)
+        fingerprint = get_file_fingerprint(file_path)
+        old_file = old_files.get(file_name)
+        if old_file and old_file["fingerprint"] == fingerprint:
+            player_name = old_file["player"]
+        else:
+            player_name = load_score_index(file_path).meta["player"]["model_name"]
+            dirty_players.add(player_name)
+        new_files[file_name] = {"fingerprint": fingerprint, "player": player_name}
+        player2shortname[player_name] = (
+            strip_result_suffix(file_name).split("player")[-1].strip("_")
+        )
+        player_files[player_name].append(file_path)
+    for file_name, old_file in old_files.items():
+        if file_name not in new_files:
+            dirty_players.add(old_file["player"])
+
+    cached_players: Dict[str, Dict[str, Any]] = manifest["players"]
+    player_cache: Dict[str, Dict[str, Any]] = dict()
+    for player_name, file_paths in sorted(player_files.items()):
+        if player_name in cached_players and player_name not in dirty_players:
+            player_cache[player_name] = cached_players[player_name]
+            continue
+        dirty_players.add(player_name)
+        stats, key_scores = collect_player_scores(file_paths, model_weights)
+        player_cache[player_name] = {
+            "stats": stats,
+            "final_scores": key_scores,
+            "row": compute_player_row(player_name, key_scores, n_bootstrap=n_bootstrap, seed=seed),
+        }
+    print(f"Recomputed players: {len(dirty_players & set(player_cache))} of {len(player_cache)}")
+
+    default_weight_signature = "_".join(map(str, METRIC_WEIGHTS[0]))
     players = dict()
-    for player_name, key_scores in final_scores.items():
+    for player_name, cache in player_cache.items():
         record: Dict[str, Any] = {}
         model_name = player2shortname[player_name]
         record["model_name"] = (
             f"[{model_name}]({{{{ '/{results_dir}/{model_name}' | relative_url}}}})"
         )
-        record["num_situations"] = len(player_dialogs[player_name])
-        outputs = list(player_dialogs[player_name].values())
-        record["avg_length"] = int(
-            mean([len(m["content"]) for o in outputs for m in o if m["role"] == "assistant"])
-        )
-        record["refusal_ratio"] = len(player_refusals[player_name]) / len(
-            player_dialogs[player_name]
-        )
-        for k, s in key_scores.items():
-            m, ci_lower, ci_upper = bootstrap_mean(s)
-            record[k] = m
-            record[k + "_ci_width"] = (ci_upper - ci_lower) / 2
+        record.update(cache["stats"])
+        record.update(cache["row"])
         players[player_name] = record
 
-    # Length normalization
+    # Length normalization depends on all players, so it is always recomputed from the cache
     median_length = median([r["avg_length"] for r in players.values()])
-    for metric_weight in metric_weights:
-        metric_weight_signature = "_".join(map(str, metric_weight))
-        final_key = f"final_{metric_weight_signature}"
-        min_score = min([r[final_key] for r in players.values()])
-        max_score = max([r[final_key] for r in players.values()])
-        score_range = max_score - min_score
+    for player_name, cache in player_cache.items():
+        record = players[player_name]
+        num_examples = len(next(iter(cache["final_scores"].values())))
+        indices = bootstrap_indices(
+            num_examples, n_bootstrap=n_bootstrap, rng=get_player_rng(player_name, seed)
+        )
         adjustment_factor = 0.07
-        for player_name, key_scores in final_scores.items():
-            record = players[player_name]
-            x = median_length / record["avg_length"]
-            x = 1 + (x - 1) * adjustment_factor
-            x = max(x, 1 - adjustment_factor)
-            x = min(x, 1)
-            v = key_scores[final_key]
+        x = median_length / record["avg_length"]
+        x = 1 + (x - 1) * adjustment_factor
+        x = max(x, 1 - adjustment_factor)
+        x = min(x, 1)
+        for metric_weight in METRIC_WEIGHTS:
+            metric_weight_signature = "_".join(map(str, metric_weight))
+            final_key = f"final_{metric_weight_signature}"
+            v = cache["final_scores"][final_key]
             s = [s * x for s in v]
-            m, ci_lower, ci_upper = bootstrap_mean(s)
+            m, ci_lower, ci_upper = bootstrap_mean(s, indices=indices)
             record[f"length_norm_score_{metric_weight_signature}"] = m
             record[f"length_norm_score_{metric_weight_signature}_ci_width"] = (ci_upper - ci_lower) / 2
 
+    # Pages of players whose result files were removed or renamed are deleted on the next
+    # build with dialogues; until then they are kept in the manifest
+    page_names = {player2shortname[player_name] for player_name in player_files}
+    stale_pages = set(manifest.get("pages", [])) - page_names
+    if manifest_path:
+        save_manifest(
+            manifest_path,
+            {
+                "params": params,
+                "files": new_files,
+                "players": player_cache,
+                "pages": sorted(page_names if dialogues_path else page_names | stale_pages),
+            },
+        )
+
     records = list(players.values())
+    if any("within_pair_sd" in record for record in records):
+        for record in records:
+            # Players without repeated samples get an empty cell
+            record.setdefault("within_pair_sd", "")
     for record in records:
         for key in list(record.keys()):
             if ("final" in key or "length_norm_score" in key) and "ci_width" not in key:
@@ -235,6 +446,7 @@ def build_table(
         ("entertaining", "entertain_score"),
         ("num_situations", "num_cases"),
         ("avg_length", "avg_length"),
+        ("within_pair_sd", "within_pair_sd"),
     )
 
     for key, value in mapping:
@@ -267,7 +479,7 @@ def build_table(
 
     # Create the table using tabulate
     table = tabulate(table_data, headers="firstrow", tablefmt="github", floatfmt=".2f")
-    for metric_weight in metric_weights:
+    for metric_weight in METRIC_WEIGHTS:
         metric_weight_signature = "_".join(map(str, metric_weight))
         key = display_str(f"avg_score_{metric_weight_signature}")
         table = table.replace(key, f'Avg score<sub data-weight="{metric_weight_signature}"></sub>')
@@ -289,29 +501,35 @@ def build_table(
             w.write(meta + table)
     if dialogues_path:
         os.makedirs(dialogues_path, exist_ok=True)
-        for player, scores in player_scores.items():
-            name = player2shortname[player]
-            judge2records = defaultdict(list)
-            for record in scores:
-                judge2records[record["judge"]["model_name"]].append(record)
-            output_path = os.path.join(dialogues_path, f"{name}.html")
-            html = "---\nlayout: default\n---\n"
-            for judge, records in sorted(judge2records.items()):
-                player = records[0]["player"]
-                player["short_name"] = player2shortname[player["model_name"]]
-                judge = records[0]["judge"]
-                judge_full_name = judge_model_mapping.get(judge["model_name"], judge["model_name"])
-                judge["short_name"] = player2shortname[judge_full_name]
-                html += generate_html(
-                    {
-                        "outputs": records,
-                        "player": records[0]["player"],
-                        "judge": records[0]["judge"],
-                        "interrogator": records[0]["interrogator"],
-                    }
-                )
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(html)
+        for name in sorted(stale_pages):
+            print(f"Removing the page of {name}")
+            page_path = os.path.join(dialogues_path, f"{name}.html")
+            if os.path.exists(page_path):
+                os.remove(page_path)
+            if os.path.exists(os.path.join(dialogues_path, name)):
+                shutil.rmtree(os.path.join(dialogues_path, name))
+        pages = []
+        for player_name, file_paths in player_files.items():
+            name = player2shortname[player_name]
+            page_path = os.path.join(dialogues_path, f"{name}.html")
+            if player_name not in dirty_players and os.path.exists(page_path):
+                continue
+            pages.append((page_path, file_paths))
+        if jobs > 1:
+            with ProcessPoolExecutor(
+                max_workers=jobs, initializer=get_template, initargs=(PLAYER_TEMPLATE_PATH,)
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        render_player_page, page_path, file_paths, player2shortname, lazy_dialogues
+                    )
+                    for page_path, file_paths in pages
+                ]
+                for future in as_completed(futures):
+                    future.result()
+        else:
+            for page_path, file_paths in pages:
+                render_player_page(page_path, file_paths, player2shortname, lazy_dialogues)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+import os
+import json
+from collections import defaultdict
+from typing import Dict, List, Optional, Any
+
+import fire  # type: ignore
+import numpy as np
+import numpy.typing as npt
+import pandas as pd  # type: ignore
+from scipy.stats import rankdata, kendalltau  # type: ignore
+from tabulate import tabulate
+
+from src.data import get_dialogue_id
+from src.result_format import list_result_files
+from src.score_index import load_score_index
+
+
+CRITERIA = ("in_character", "entertaining", "fluency")
+OLD_KEY_MAPPING = {
+    "stay_in_character": "in_character",
+    "entertainment": "entertaining",
+    "language_fluency": "fluency",
+}
+
+
+def load_reference(ref_path: str, ref_key: str) -> Dict[str, npt.NDArray[np.float64]]:
+    references = dict()
+    with open(ref_path, encoding="utf-8") as r:
+        for line in r:
+            record = json.loads(line)
+            scores = record[ref_key]
+            row = [float(scores[c]) for c in CRITERIA]
+            references[get_dialogue_id(record)] = np.array(row + [float(np.mean(row))])
+    return references
+
+
+def column_spearman(x: npt.NDArray[np.float64], y: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    # Pearson correlation of average ranks, for all columns at once
+    rx = rankdata(x, axis=0)
+    ry = rankdata(y, axis=0)
+    rx -= rx.mean(axis=0)
+    ry -= ry.mean(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result: npt.NDArray[np.float64] = (rx * ry).sum(axis=0) / np.sqrt(
+            (rx**2).sum(axis=0) * (ry**2).sum(axis=0)
+        )
+    return result
+
+
+def main(
+    pred_dir: str,
+    ref_path: str,
+    scores_key: str = "new_scores",
+    ref_key: str = "human_scores",
+    use_old_keys: bool = False,
+    output_path: Optional[str] = None,
+) -> None:
+    references = load_reference(ref_path, ref_key)
+    header = list(CRITERIA) + ["final"]
+    # judge -> dialogue ID -> predicted criteria and final, pooled over the judge's files
+    judge_predictions: Dict[str, Dict[str, npt.NDArray[np.float64]]] = defaultdict(dict)
+    judge_files: Dict[str, List[str]] = defaultdict(list)
+    for file_name in list_result_files(pred_dir):
+        index = load_score_index(os.path.join(pred_dir, file_name))
+        positions = [i for i, key in enumerate(index.keys.tolist()) if key in references]
+        if not positions:
+            continue
+        metric_names = {
+            OLD_KEY_MAPPING.get(m, m) if use_old_keys else m: m for m in index.metrics(scores_key)
+        }
+        predictions = np.stack(
+            [index.mean_scores(metric_names[c], scores_key)[positions] for c in CRITERIA], axis=1
+        )
+        predictions = np.concatenate([predictions, predictions.mean(axis=1, keepdims=True)], axis=1)
+        judge_name = index.meta["judge"]["model_name"]
+        judge_files[judge_name].append(file_name)
+        for row_index, i in enumerate(positions):
+            judge_predictions[judge_name].setdefault(str(index.keys[i]), predictions[row_index])
+
+    rows: List[Dict[str, Any]] = []
+    for judge_name, dialogue_predictions in sorted(judge_predictions.items()):
+        if len(dialogue_predictions) < 3:
+            continue
+        predictions = np.stack(list(dialogue_predictions.values()))
+        human = np.stack([references[key] for key in dialogue_predictions])
+        spearman = column_spearman(predictions, human)
+        row: Dict[str, Any] = {
+            "judge": judge_name,
+            "files": len(judge_files[judge_name]),
+            "support": len(dialogue_predictions),
+        }
+        for c, criterion in enumerate(header):
+            row[f"spearman_{criterion}"] = spearman[c]
+            row[f"kendall_{criterion}"] = kendalltau(predictions[:, c], human[:, c]).statistic
+        rows.append(row)
+
+    if not rows:
+        print(f"No judge has at least 3 dialogues from {ref_path} in {pred_dir}")
+        return
+    df = pd.DataFrame(rows).sort_values(by="spearman_final", ascending=False)
+    print(tabulate(df, headers="keys", tablefmt="github", floatfmt=".3f", showindex=False))
+    if output_path:
+        df.to_csv(output_path, index=False)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -1,22 +1,26 @@
 import json
 import os
-from statistics import mean, median
+from statistics import mean
 from collections import defaultdict
-from typing import List, Dict, Any, Optional
+from typing import Dict, Optional
 
 import fire  # type: ignore
 import numpy as np
-import networkx as nx  # type: ignore
-import matplotlib.pyplot as plt  # type: ignore
-from pyvis.network import Network  # type: ignore
-from scipy.stats import spearmanr # type: ignore
-from krippendorff import alpha  # type: ignore
 
+from src.agreement import bootstrap_alpha, build_rating_matrix, pairwise_correlations
+from src.data import get_dialogue_id
 
-def main(input_dir: str, exclude_name: Optional[str] = None) -> None:
-    ratings = defaultdict(list)
+
+def main(
+    input_dir: str,
+    exclude_name: Optional[str] = None,
+    level: str = "ordinal",
+    n_bootstrap: int = 1000,
+    seed: int = 42,
+) -> None:
+    ratings: Dict[str, Dict[str, Dict[str, float]]] = defaultdict(dict)
     header = ["in_character", "entertaining", "fluency", "final"]
-    for name in os.listdir(input_dir):
+    for name in sorted(os.listdir(input_dir)):
         if not name.endswith(".jsonl"):
             continue
         if exclude_name and name == exclude_name:
@@ -25,20 +29,29 @@ def main(input_dir: str, exclude_name: Optional[str] = None) -> None:
         with open(file_name) as r:
             for line in r:
                 record = json.loads(line)
-                key = str(record["messages"])
-                human_scores = record["human_scores"]
-                scores = [human_scores[k] for k in header if k != "final"]
-                scores.append(mean(scores))
-                ratings[key].append(np.array(scores))
-    plain_ratings = []
-    for _, rating in ratings.items():
-        plain_ratings.append(np.array(rating))
-    ratings_array = np.array(plain_ratings)
+                key = get_dialogue_id(record)
+                human_scores = dict(record["human_scores"])
+                human_scores["final"] = mean([human_scores[k] for k in header if k != "final"])
+                ratings[name][key] = human_scores
+
+    annotators, items, matrix = build_rating_matrix(ratings, header)
+    num_ratings = (~np.isnan(matrix[0])).sum(axis=1)
+    print("Annotators:", ", ".join(f"{a} ({n})" for a, n in zip(annotators, num_ratings)))
+    print("Items:", len(items))
+    rng = np.random.default_rng(seed)
     for i, criterion in enumerate(header):
-        criterion_ratings = ratings_array[:, :, i]
-        criterion_ratings = np.transpose(criterion_ratings)
-        k_alpha = alpha(reliability_data=criterion_ratings, level_of_measurement="ordinal")
-        print("Alpha", criterion, k_alpha)
+        criterion_ratings = matrix[i]
+        k_alpha, ci_lower, ci_upper = bootstrap_alpha(
+            criterion_ratings, level=level, n_bootstrap=n_bootstrap, rng=rng
+        )
+        print(f"Alpha, {criterion}, {k_alpha:.3f} [{ci_lower:.3f}, {ci_upper:.3f}]")
+        correlations = pairwise_correlations(criterion_ratings)
+        if not correlations:
+            continue
+        spearman = np.nanmean([s for s, _, _ in correlations.values()])
+        kendall = np.nanmean([k for _, k, _ in correlations.values()])
+        print(f"Pairwise Spearman, {criterion}, {spearman:.3f}")
+        print(f"Pairwise Kendall, {criterion}, {kendall:.3f}")
 
 
 if __name__ == "__main__":
@@ -1,85 +1,108 @@
 import os
-import json
 from collections import defaultdict
-from typing import Dict, Any
+from typing import Dict, List, Tuple
 
 import fire  # type: ignore
+import numpy as np
+import numpy.typing as npt
+from tabulate import tabulate
 
-from scipy.stats import kendalltau  # type: ignore
+from src.ranking_agreement import agreement_report
+from src.result_format import list_result_files
+from src.score_index import load_score_index
+from src.transcript_store import TranscriptStore
 
 
-def collect_interrogator_exp(
-    input_dir: str
+def print_report(
+    title: str,
+    raters: List[str],
+    players: List[str],
+    cells: Dict[Tuple[int, int], npt.NDArray[np.float64]],
+    n_bootstrap: int,
+    seed: int,
 ) -> None:
-    players = set()
-    judges = set()
-    interrogators = set()
-    scores: Dict[str, Dict[str, Any]] = defaultdict(dict)
-    judge_scores: Dict[str, Dict[str, Any]] = defaultdict(dict)
-    for file_name in os.listdir(input_dir):
-        with open(os.path.join(input_dir, file_name)) as r:
-            record = json.load(r)
-            interrogator = record["interrogator"]["model_name"]
-            player = record["player"]["model_name"]
-            judge = record["judge"]["model_name"]
-            final_score = record["final_score"]
-            players.add(player)
-            judges.add(judge)
-            interrogators.add(interrogator)
-            scores[interrogator][player] = (final_score, len(record["outputs"]))
-            judge_scores[judge][player] = (final_score, len(record["outputs"]))
+    report = agreement_report(cells, len(raters), len(players), n_bootstrap=n_bootstrap, seed=seed)
+    print(f"By {title}:")
+    table = [
+        [p] + [None if np.isnan(s) else s for s in report.scores[:, i]]
+        for i, p in enumerate(players)
+    ]
+    headers = ["player"] + raters
+    print(tabulate(table, headers=headers, tablefmt="github", floatfmt=".3f", missingval="-"))
+    print()
+    for name, matrix, mean, (ci_lower, ci_upper) in (
+        ("Kendall", report.kendall, report.mean_kendall, report.mean_kendall_ci),
+        ("Spearman", report.spearman, report.mean_spearman, report.mean_spearman_ci),
+    ):
+        rows = [[r] + matrix[i].tolist() for i, r in enumerate(raters)]
+        print(f"{name} agreement matrix:")
+        print(tabulate(rows, headers=[title] + raters, tablefmt="github", floatfmt=".3f"))
+        print(f"Average {name}: {mean:.3f} [{ci_lower:.3f}, {ci_upper:.3f}]")
+        print()
+    print("Bootstrap ranking stability (Kendall vs point ranking):")
+    for rater, value in zip(raters, report.stability):
+        print(f"{title}={rater}, stability={value:.3f}")
+    print()
 
-    interrogators_list = list(interrogators)
-    players_list = list(players)
-    judges_list = list(judges)
 
-    print("Players:", players_list)
-    print("By interrogator:")
-    rankings = list()
-    for interrogator in interrogators_list:
-        player_scores = sorted([(v, k) for k, v in scores[interrogator].items()], reverse=True)
-        print(f"interrogator={interrogator}")
-        ranking = [-1 for _ in range(len(players_list))]
-        for rank, (score, player) in enumerate(player_scores):
-            index = players_list.index(player)
-            ranking[index] = rank
-            print(f"player={player}, score={score}")
-        assert -1 not in ranking, players_list[ranking.index(-1)]
-        rankings.append(ranking)
-        print()
-    print(rankings)
-    coefs = []
-    for i, r1 in enumerate(rankings):
-        for r2_index in range(i + 1, len(rankings)):
-            r2 = rankings[r2_index]
-            coefs.append(kendalltau(r1, r2).statistic)
-    print(coefs)
-    if coefs:
-        print("Average Kendall Tau:", sum(coefs) / len(coefs))
+Cells = Dict[Tuple[str, str], List[float]]
+
+
+def collect_store_cells(store_path: str) -> Tuple[Cells, Cells]:
+    # The store index holds the models and the final score of every dialogue,
+    # so the cells are built without reading a single transcript
+    assert os.path.exists(store_path), f"No transcript store at {store_path}"
+    interrogator_cells: Cells = defaultdict(list)
+    judge_cells: Cells = defaultdict(list)
+    store = TranscriptStore(store_path)
+    fields = store.fields
+    valid = ~fields["refusals"]
+    for interrogator, judge, player, score in zip(
+        fields["interrogators"][valid].tolist(),
+        fields["judges"][valid].tolist(),
+        fields["players"][valid].tolist(),
+        fields["final_scores"][valid].tolist(),
+    ):
+        interrogator_cells[(interrogator, player)].append(score)
+        judge_cells[(judge, player)].append(score)
+    store.close()
+    return interrogator_cells, judge_cells
 
+
+def collect_result_cells(input_dir: str) -> Tuple[Cells, Cells]:
+    interrogator_cells: Cells = defaultdict(list)
+    judge_cells: Cells = defaultdict(list)
+    for file_name in list_result_files(input_dir):
+        score_index = load_score_index(os.path.join(input_dir, file_name))
+        interrogator = score_index.meta["interrogator"]["model_name"]
+        player = score_index.meta["player"]["model_name"]
+        judge = score_index.meta["judge"]["model_name"]
+        metrics = [m for m in score_index.metrics() if "refusal" not in m]
+        totals = np.mean([score_index.mean_scores(m) for m in metrics], axis=0)
+        totals = totals[~score_index.refusals()].tolist()
+        interrogator_cells[(interrogator, player)].extend(totals)
+        judge_cells[(judge, player)].extend(totals)
+    return interrogator_cells, judge_cells
+
+
+def collect_interrogator_exp(input_path: str, n_bootstrap: int = 1000, seed: int = 42) -> None:
+    # (interrogator or judge, player) -> per-dialogue scores, pooled over files.
+    # input_path is a results directory or a transcript store built by src.transcript_store.
+    if os.path.isdir(input_path):
+        interrogator_cells, judge_cells = collect_result_cells(input_path)
+    else:
+        interrogator_cells, judge_cells = collect_store_cells(input_path)
+
+    players = sorted({p for _, p in interrogator_cells})
+    print("Players:", players)
     print()
-    print("By judge:")
-    rankings = list()
-    for judge in judges_list:
-        player_scores = sorted([(v, k) for k, v in judge_scores[judge].items()], reverse=True)
-        print(f"judge={judge}")
-        ranking = [-1 for _ in range(len(players_list))]
-        for rank, (score, player) in enumerate(player_scores):
-            index = players_list.index(player)
-            ranking[index] = rank
-            print(f"player={player}, score={score}")
-        assert -1 not in ranking, players_list[ranking.index(-1)]
-        rankings.append(ranking)
-        print()
-    print(rankings)
-    coefs = []
-    for i, r1 in enumerate(rankings):
-        for r2_index in range(i + 1, len(rankings)):
-            r2 = rankings[r2_index]
-            coefs.append(kendalltau(r1, r2).statistic)
-    print(coefs)
-    if coefs:
-        print("Average Kendall Tau:", sum(coefs) / len(coefs))
+    for title, named_cells in (("interrogator", interrogator_cells), ("judge", judge_cells)):
+        raters = sorted({r for r, _ in named_cells})
+        cells = {
+            (raters.index(r), players.index(p)): np.array(v, dtype=np.float64)
+            for (r, p), v in named_cells.items()
+        }
+        print_report(title, raters, players, cells, n_bootstrap=n_bootstrap, seed=seed)
 
 
 if __name__ == "__main__":
@@ -12,27 +12,30 @@ import matplotlib.pyplot as plt  # type: ignore
 from pyvis.network import Network  # type: ignore
 from scipy.stats import spearmanr, kendalltau
 
+from src.data import get_dialogue_id
+from src.result_format import list_result_files, load_result
+
 
 def main(input_dir: str, golden_path: str, metric: str = "final") -> None:
     golden_records = dict()
     with open(golden_path) as r:
         for line in r:
             record = json.loads(line)
-            golden_records[str(record["messages"])] = record["human_scores"]
+            golden_records[get_dialogue_id(record)] = record["human_scores"]
 
     all_scores: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(lambda: defaultdict(dict))
-    for name in os.listdir(input_dir):
+    for name in list_result_files(input_dir):
         path = os.path.join(input_dir, name)
-        with open(path) as r:
-            data = json.load(r)
-            for output in data["outputs"]:
-                judge = data["judge"]["model_name"]
-                scores = output["new_scores"]
-                is_refusal = scores.pop("is_refusal")
-                if max(is_refusal) == 1:
-                    continue
-                key = str(output["messages"])
-                all_scores[key][judge] = output
+        data = load_result(path)
+        player_name = (data.get("player") or dict()).get("model_name")
+        for output in data["outputs"]:
+            judge = data["judge"]["model_name"]
+            scores = output["new_scores"]
+            is_refusal = scores.pop("is_refusal")
+            if max(is_refusal) == 1:
+                continue
+            key = get_dialogue_id(output, player_name)
+            all_scores[key][judge] = output
 
     human_scores = []
     sonnet_scores = []
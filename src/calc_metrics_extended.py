@@ -1,71 +1,41 @@
-import json
 import os
-from statistics import mean, median
+from statistics import mean
 from collections import defaultdict
-from typing import List, Dict, Any
+from typing import List, Dict, Optional, Tuple
 
 import fire  # type: ignore
 import numpy as np
 from scipy.stats import spearmanr  # type: ignore
-import networkx as nx  # type: ignore
-import matplotlib.pyplot as plt  # type: ignore
-from pyvis.network import Network  # type: ignore
 
+from src.judge_weights import build_judge_graph, compute_judge_weights
+from src.result_format import list_result_files
+from src.score_index import load_score_index
 
-def main(input_dir: str) -> None:
+
+def main(input_dir: str, graph_path: Optional[str] = "graph.html") -> None:
     agg_data: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
-    all_scores: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(lambda: defaultdict(dict))
+    all_scores: Dict[str, Dict[str, Tuple[float, float]]] = defaultdict(dict)
     judge_scores = defaultdict(list)
-    models = list()
-    for name in os.listdir(input_dir):
-        path = os.path.join(input_dir, name)
-        with open(path) as r:
-            data = json.load(r)
-            for output in data["outputs"]:
-                player = output["player"]
-                judge = data["judge"]
-                scores = output["new_scores"]
-                is_refusal = scores.pop("is_refusal")
-                if max(is_refusal) == 1:
-                    continue
-                output_scores = []
-                for value in scores.values():
-                    output_scores.append(mean(value))
-                models.append(judge["model_name"])
-                agg_data[judge["model_name"]][player["model_name"]].append(mean(output_scores))
-                judge_scores[judge["model_name"]].append(mean(output_scores))
-                all_scores[str(output["messages"])][judge["model_name"]] = output
-    models = list(set(models))
-    G = nx.DiGraph()
-    for i, model in enumerate(models):
-        G.add_node(i, label=model)
-    for judge_model, scores in agg_data.items():
-        all_judge_scores = []
-        for player_model, s in scores.items():
-            if player_model in models:
-                all_judge_scores.extend(s)
-        min_score = np.percentile(all_judge_scores, 10)
-        max_score = np.percentile(all_judge_scores, 90)
-        print(min_score, max_score)
-        for player_model, player_scores in scores.items():
-            if player_model not in models:
-                continue
-            if player_model == judge_model:
+    for name in list_result_files(input_dir):
+        index = load_score_index(os.path.join(input_dir, name))
+        judge_name = index.meta["judge"]["model_name"]
+        refusals = index.refusals("new_scores")
+        metrics = [m for m in index.metrics("new_scores") if m != "is_refusal"]
+        total_scores = np.mean([index.mean_scores(m, "new_scores") for m in metrics], axis=0)
+        human_metrics = index.metrics("human_scores")
+        human_scores = np.full(len(index), np.nan)
+        if human_metrics:
+            human_scores = np.mean([index.mean_scores(m, "human_scores") for m in human_metrics], axis=0)
+        for i, key in enumerate(index.keys.tolist()):
+            if refusals[i]:
                 continue
-            real_score = mean(player_scores)
-            final_score = min(max((real_score - min_score) / (max_score - min_score), 0.0), 1.0)
-            G.add_edge(
-                models.index(judge_model),
-                models.index(player_model),
-                weight=final_score,
-                label=str(int(final_score * 100)),
-            )
-            print(judge_model, player_model, final_score, real_score)
-
-    pr = nx.pagerank(G, alpha=1.0)
-    model_weights = dict()
-    for idx, value in pr.items():
-        model_weights[models[idx]] = value
+            player_name = str(index.players[i])
+            total_score = float(total_scores[i])
+            agg_data[judge_name][player_name].append(total_score)
+            judge_scores[judge_name].append(total_score)
+            all_scores[key][judge_name] = (total_score, float(human_scores[i]))
+    models, graph = build_judge_graph(agg_data)
+    model_weights = compute_judge_weights(agg_data)
     print(model_weights)
 
     mean_scores = {k: mean(v) for k, v in judge_scores.items()}
@@ -76,25 +46,17 @@ def main(input_dir: str) -> None:
     total_model_sonnet_scores = []
     total_model_top_2_scores = []
     for _, example_scores in all_scores.items():
-        human_scores = None
+        total_human_score = None
         total_model_score = dict()
-        count = 0
-        for judge_model, output in example_scores.items():
-            human_scores = output["human_scores"]
-            judge_scores = output["new_scores"]
-            judge_scores.pop("is_refusal", None)
-            output_scores = []
-            for value in judge_scores.values():
-                output_scores.append(mean(value))
-            total_judge_score = mean(output_scores) - mean_scores[judge_model]
-            total_model_score[judge_model] = total_judge_score
-            count += 1
-        if not human_scores:
+        for judge_model, (judge_score, human_score) in example_scores.items():
+            if not np.isnan(human_score):
+                total_human_score = human_score
+            total_model_score[judge_model] = judge_score - mean_scores[judge_model]
+        if total_human_score is None:
             continue
         if "claude-3-5-sonnet-20240620" not in total_model_score:
             continue
 
-        total_human_score = mean(human_scores.values())
         total_human_scores.append(total_human_score)
 
         weights = {k: model_weights[k] for k in total_model_score.keys()}
@@ -123,13 +85,22 @@ def main(input_dir: str) -> None:
     print("Best model only:", spearmanr(total_human_scores, total_model_sonnet_scores)[0])
     print("Top-2:", spearmanr(total_human_scores, total_model_top_2_scores)[0])
 
-    net = Network(directed=True, height="1000px")
-    net.from_nx(G)
-    net.toggle_physics(True)
-    net.barnes_hut(
-        spring_strength=0.006,
-    )
-    net.show("graph.html", notebook=False)
+    if graph_path:
+        import networkx as nx  # type: ignore
+        from pyvis.network import Network  # type: ignore
+
+        G = nx.from_scipy_sparse_array(graph, create_using=nx.DiGraph)
+        for i, model in enumerate(models):
+            G.nodes[i]["label"] = model
+        for _, _, edge in G.edges(data=True):
+            edge["label"] = str(int(edge["weight"] * 100))
+        net = Network(directed=True, height="1000px")
+        net.from_nx(G)
+        net.toggle_physics(True)
+        net.barnes_hut(
+            spring_strength=0.006,
+        )
+        net.show(graph_path, notebook=False)
 
 
 if __name__ == "__main__":
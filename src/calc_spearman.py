@@ -2,10 +2,34 @@ import sys
 import json
 from collections import defaultdict
 from statistics import mean
+from typing import Dict, List, Tuple
 
 import fire  # type: ignore
 from scipy.stats import spearmanr, kendalltau  # type: ignore
 
+from src.data import get_dialogue_id, index_by_dialogue_id
+from src.result_format import is_result_file
+from src.score_index import load_score_index
+
+
+def load_predictions(pred_path: str, scores_key: str) -> List[Tuple[str, Dict[str, float]]]:
+    if is_result_file(pred_path):
+        index = load_score_index(pred_path)
+        means = {m: index.mean_scores(m, scores_key) for m in index.metrics(scores_key)}
+        return [
+            (key, {m: float(v[i]) for m, v in means.items()})
+            for i, key in enumerate(index.keys.tolist())
+        ]
+    predictions = []
+    with open(pred_path) as r:
+        for line in r:
+            record = json.loads(line)
+            scores = {
+                k: mean(s) if isinstance(s, list) else s for k, s in record[scores_key].items()
+            }
+            predictions.append((get_dialogue_id(record), scores))
+    return predictions
+
 
 def main(
     pred_path: str,
@@ -14,14 +38,10 @@ def main(
     scores_key: str = "new_scores",
     ref_key: str = "human_scores",
 ) -> None:
-    with open(pred_path) as r:
-        if pred_path.endswith(".json"):
-            predictions = json.load(r)["outputs"]
-        else:
-            predictions = [json.loads(line) for line in r]
+    predictions = load_predictions(pred_path, scores_key)
     with open(ref_path) as r:
         ref_list = [json.loads(line) for line in r]
-        references = {str(rec["messages"]): rec for rec in ref_list}
+        references = index_by_dialogue_id(ref_list)
 
     human_scores = defaultdict(list)
     model_scores = defaultdict(list)
@@ -31,17 +51,16 @@ def main(
         "language_fluency": "fluency",
     }
     model_names = list()
-    for prediction in predictions:
-        key = str(prediction["messages"])
+    for key, prediction_scores in predictions:
         if key not in references:
             continue
         reference = references[key]
         for key, score in reference[ref_key].items():
             human_scores[key].append(score)
-        for key, score in prediction[scores_key].items():
+        for key, score in prediction_scores.items():
             if use_old_keys:
                 key = old_key_mapping[key]
-            model_scores[key].append(mean(score) if isinstance(score, list) else score)
+            model_scores[key].append(score)
         model_names.append(reference["player"]["model_name"])
 
     final_human_scores = [mean(s) for s in zip(*[scores for _, scores in human_scores.items()])]
@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+from typing import Any, Dict, List, Optional
+
+import fire  # type: ignore
+
+from src.data import BUNDLE_VERSION, Settings, get_bundle_hash
+from src.provider import LLMProvider
+from src.util import encode_prompt, generate
+
+
+PROMPT_PATH_FIELDS = (
+    "interrogator_system_prompt_path",
+    "interrogator_user_prompt_path",
+    "judge_system_prompt_path",
+    "judge_user_prompt_path",
+    "character_prompt_path",
+)
+
+
+def validate_settings(language: str, settings: Settings) -> List[str]:
+    errors = []
+    char_names = [c.char_name for c in settings.characters]
+    for name in sorted({n for n in char_names if char_names.count(n) > 1}):
+        errors.append(f"{language}: duplicate character {name}")
+    for character in settings.characters:
+        if not character.char_name.strip() or not character.system_prompt.strip():
+            errors.append(f"{language}: character {character.char_name!r} has an empty field")
+    texts = [s.text for s in settings.situations]
+    for i, situation in enumerate(settings.situations):
+        if texts.index(situation.text) != i:
+            errors.append(f"{language}: situation {i} duplicates situation {texts.index(situation.text)}")
+        if situation.num_turns < 1:
+            errors.append(f"{language}: situation {i} has {situation.num_turns} turns")
+    for field in PROMPT_PATH_FIELDS:
+        path = getattr(settings, field)
+        if not os.path.exists(path):
+            errors.append(f"{language}: {field} {path} does not exist")
+    return errors
+
+
+def get_summary_key(card: str, model_name: str) -> str:
+    text = json.dumps([card, model_name], ensure_ascii=False)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def compile_settings(
+    settings_path: str,
+    output_path: str,
+    providers_path: Optional[str] = None,
+    summarizer_name: Optional[str] = None,
+    summary_cache_path: str = "summaries_cache.json",
+    summary_prompt_path: str = "templates/v2/character_summary.jinja",
+) -> None:
+    with open(settings_path, encoding="utf-8") as r:
+        raw_settings = json.load(r)
+
+    all_settings = {language: Settings.from_dict(s) for language, s in raw_settings.items()}
+    errors = []
+    for language, settings in all_settings.items():
+        errors.extend(validate_settings(language, settings))
+    if errors:
+        raise ValueError("Invalid settings:\n" + "\n".join(errors))
+
+    summarizer: Optional[LLMProvider] = None
+    if providers_path and summarizer_name:
+        with open(providers_path, encoding="utf-8") as r:
+            summarizer = LLMProvider(**json.load(r)[summarizer_name])
+    summary_cache: Dict[str, str] = dict()
+    if os.path.exists(summary_cache_path):
+        with open(summary_cache_path, encoding="utf-8") as r:
+            summary_cache = json.load(r)
+
+    languages: Dict[str, Any] = dict()
+    for language, settings in all_settings.items():
+        cards = dict()
+        for character in settings.characters:
+            card = encode_prompt(settings.character_prompt_path, character=character)
+            cards[character.char_name] = card
+            if character.summary:
+                continue
+            # Generated summaries are cached by card and model, so recompiling is free
+            if summarizer is None:
+                raise ValueError(
+                    f"{language}: no summary for {character.char_name}, "
+                    "pass --providers-path and --summarizer-name to generate it"
+                )
+            summary_key = get_summary_key(card, summarizer.model_name)
+            if summary_key not in summary_cache:
+                prompt = [
+                    {
+                        "role": "user",
+                        "content": encode_prompt(summary_prompt_path, char_description=card),
+                    }
+                ]
+                summary_cache[summary_key] = generate(prompt, provider=summarizer, temperature=0.0)
+                with open(summary_cache_path, "w", encoding="utf-8") as w:
+                    json.dump(summary_cache, w, ensure_ascii=False, indent=4)
+            character.summary = summary_cache[summary_key]
+            print(f"{language}: {character.char_name}: {character.summary}")
+        settings.cards = cards
+        languages[language] = settings.to_dict()
+
+    bundle = {
+        "bundle_version": BUNDLE_VERSION,
+        "source": os.path.basename(settings_path),
+        "hash": get_bundle_hash(languages),
+        "languages": languages,
+    }
+    with open(output_path, "w", encoding="utf-8") as w:
+        json.dump(bundle, w, ensure_ascii=False, indent=4)
+    print(f"{output_path}: {bundle['hash']}")
+
+
+if __name__ == "__main__":
+    fire.Fire(compile_settings)
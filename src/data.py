@@ -1,3 +1,6 @@
+import json
+import hashlib
+from collections import defaultdict
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional, Tuple
 
@@ -35,7 +38,128 @@ class Settings(DataClassJsonMixin):
     judge_user_prompt_path: str
     judge_system_prompt_path: str
     character_prompt_path: str
+    # Rendered character prompts by name, filled by src.compile_settings
+    cards: Optional[Dict[str, str]] = None
+
+    def get_card(self, character: Character) -> Optional[str]:
+        # A card is only valid for the exact character it was rendered from
+        card = (self.cards or dict()).get(character.char_name)
+        if card is None or character not in self.characters:
+            return None
+        return card
+
+
+BUNDLE_VERSION = 1
+
+
+def get_bundle_hash(languages: Dict[str, Any]) -> str:
+    text = json.dumps(languages, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def get_languages(settings_path: str, language: Any) -> List[str]:
+    # "en", "en,ru" or "all" for every language in the settings
+    if language != "all":
+        return split_list(language)
+    with open(settings_path, encoding="utf-8") as r:
+        data = json.load(r)
+    return list(data["languages"] if "bundle_version" in data else data)
+
+
+def get_language_path(path: str, language: str, num_languages: int = 1) -> str:
+    # "{lang}" in a path is replaced, e.g. results/v2/{lang}/player.json
+    if "{lang}" not in path:
+        assert num_languages == 1, f"{path} needs a {{lang}} placeholder for several languages"
+        return path
+    return path.replace("{lang}", language)
+
+
+def load_settings(settings_path: str, language: str) -> Settings:
+    # Either a raw settings file or a bundle compiled from it
+    with open(settings_path, encoding="utf-8") as r:
+        data = json.load(r)
+    if "bundle_version" in data:
+        assert data["bundle_version"] == BUNDLE_VERSION, data["bundle_version"]
+        if get_bundle_hash(data["languages"]) != data["hash"]:
+            raise ValueError(f"{settings_path} was modified after compilation, compile it again")
+        data = data["languages"]
+    return Settings.from_dict(data[language])
 
 
 def compose_key(character: Character, situation: Situation) -> Tuple[str, str]:
     return (character.char_name, situation.text)
+
+
+def split_list(value: Any) -> List[str]:
+    # Fire turns "a,b" into a tuple and "a" into a string
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value]
+    return [v.strip() for v in str(value).split(",") if v.strip()]
+
+
+def has_any_tag(tags: Optional[List[str]], selected: Optional[List[str]]) -> bool:
+    return not selected or bool(set(tags or []) & set(selected))
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    # "i/n" with 0 <= i < n
+    index, num_shards = (int(v) for v in str(shard).split("/"))
+    assert 0 <= index < num_shards, shard
+    return index, num_shards
+
+
+def get_shard(key: Tuple[str, str], num_shards: int) -> int:
+    # Stable across processes and runs, unlike the built-in hash
+    text = json.dumps(key, ensure_ascii=False)
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest(), 16) % num_shards
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def compose_dialogue_id(
+    player_name: str, char_name: str, situation_text: str, messages: ChatMessages, sample: int = 0
+) -> str:
+    payload: Dict[str, Any] = {
+        "player": player_name.strip(),
+        "character": _normalize_text(char_name),
+        "situation": _normalize_text(situation_text),
+        "messages": [(m["role"].strip().lower(), _normalize_text(m["content"])) for m in messages],
+    }
+    # Only extra samples of a pair are salted, so single-sample IDs stay the same
+    if sample:
+        payload["sample"] = sample
+    text = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def get_dialogue_id(record: Dict[str, Any], player_name: Optional[str] = None) -> str:
+    dialogue_id = record.get("dialogue_id")
+    if dialogue_id:
+        return str(dialogue_id)
+    player = record.get("player")
+    if isinstance(player, dict):
+        player_name = player.get("model_name", player_name)
+    return compose_dialogue_id(
+        player_name=player_name or "",
+        char_name=record["character"]["char_name"],
+        situation_text=record["situation"]["text"],
+        messages=record["messages"],
+        sample=int(record.get("sample", 0)),
+    )
+
+
+def group_by_dialogue_id(
+    records: List[Dict[str, Any]], player_name: Optional[str] = None
+) -> Dict[str, List[Dict[str, Any]]]:
+    groups: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for record in records:
+        groups[get_dialogue_id(record, player_name)].append(record)
+    return groups
+
+
+def index_by_dialogue_id(
+    records: List[Dict[str, Any]], player_name: Optional[str] = None
+) -> Dict[str, Dict[str, Any]]:
+    return {get_dialogue_id(record, player_name): record for record in records}
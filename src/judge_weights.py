@@ -0,0 +1,125 @@
+import os
+import json
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import fire  # type: ignore
+import numpy as np
+import numpy.typing as npt
+from scipy import sparse  # type: ignore
+
+from src.result_format import list_result_files
+from src.score_index import load_score_index
+
+
+JudgePlayerScores = Dict[str, Dict[str, List[float]]]
+
+
+def collect_judge_player_scores(
+    file_paths: List[str],
+    field: str = "scores",
+    judge_mapping: Optional[Dict[str, str]] = None,
+) -> JudgePlayerScores:
+    # judge -> player -> per-dialogue mean of all criteria, refusals excluded
+    judge_mapping = judge_mapping or dict()
+    scores: JudgePlayerScores = defaultdict(lambda: defaultdict(list))
+    for file_path in sorted(file_paths):
+        index = load_score_index(file_path)
+        judge_name = index.meta["judge"]["model_name"]
+        judge_name = judge_mapping.get(judge_name, judge_name)
+        metrics = [m for m in index.metrics(field) if "refusal" not in m]
+        if not metrics:
+            continue
+        totals = np.mean([index.mean_scores(m, field) for m in metrics], axis=0)
+        keep = ~index.refusals(field)
+        for player_name, total in zip(index.players[keep].tolist(), totals[keep].tolist()):
+            scores[judge_name][player_name].append(total)
+    return {judge: dict(player_scores) for judge, player_scores in scores.items()}
+
+
+def build_judge_graph(
+    scores: JudgePlayerScores,
+) -> Tuple[List[str], sparse.csr_matrix]:
+    # Edge judge -> player, weighted by the player's normalised score from that judge.
+    # Only models that are themselves judges take part.
+    models = sorted(scores.keys())
+    model_index = {model: i for i, model in enumerate(models)}
+    rows, cols, weights = [], [], []
+    for judge_model, player_scores in scores.items():
+        all_judge_scores = [s for p, ps in player_scores.items() if p in model_index for s in ps]
+        if not all_judge_scores:
+            continue
+        min_score, max_score = np.percentile(all_judge_scores, [10, 90])
+        for player_model, judge_player_scores in player_scores.items():
+            if player_model not in model_index or player_model == judge_model:
+                continue
+            real_score = float(np.mean(judge_player_scores))
+            final_score = min(max((real_score - min_score) / (max_score - min_score), 0.0), 1.0)
+            rows.append(model_index[judge_model])
+            cols.append(model_index[player_model])
+            weights.append(final_score)
+    size = len(models)
+    graph = sparse.csr_matrix((weights, (rows, cols)), shape=(size, size), dtype=np.float64)
+    return models, graph
+
+
+def pagerank(
+    graph: sparse.csr_matrix, alpha: float = 1.0, max_iter: int = 100, tol: float = 1.0e-6
+) -> npt.NDArray[np.float64]:
+    # Same iteration as networkx.pagerank with uniform personalization and dangling weights
+    size = graph.shape[0]
+    out_weights = np.asarray(graph.sum(axis=1)).ravel()
+    dangling = out_weights == 0
+    inverse = np.divide(1.0, out_weights, out=np.zeros(size), where=~dangling)
+    transition = sparse.diags(inverse) @ graph
+    uniform = np.full(size, 1.0 / size)
+    x = uniform.copy()
+    for _ in range(max_iter):
+        last = x
+        x = alpha * (transition.T @ x + x[dangling].sum() * uniform) + (1 - alpha) * uniform
+        if np.abs(x - last).sum() < size * tol:
+            result: npt.NDArray[np.float64] = x
+            return result
+    raise RuntimeError(f"PageRank did not converge in {max_iter} iterations")
+
+
+def compute_judge_weights(scores: JudgePlayerScores) -> Dict[str, float]:
+    models, graph = build_judge_graph(scores)
+    ranks = pagerank(graph)
+    return {model: float(rank) for model, rank in zip(models, ranks)}
+
+
+def load_judge_weights(
+    file_paths: List[str],
+    cache_path: Optional[str] = None,
+    field: str = "scores",
+    judge_mapping: Optional[Dict[str, str]] = None,
+) -> Dict[str, float]:
+    fingerprints = dict()
+    for file_path in sorted(file_paths):
+        stat = os.stat(file_path)
+        fingerprints[file_path] = [stat.st_mtime_ns, stat.st_size]
+    cache_key = {"field": field, "judge_mapping": judge_mapping or dict(), "files": fingerprints}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as r:
+            cache = json.load(r)
+        if cache["key"] == cache_key:
+            weights: Dict[str, float] = cache["weights"]
+            return weights
+    scores = collect_judge_player_scores(file_paths, field=field, judge_mapping=judge_mapping)
+    weights = compute_judge_weights(scores)
+    if cache_path:
+        with open(cache_path, "w", encoding="utf-8") as w:
+            json.dump({"key": cache_key, "weights": weights}, w, ensure_ascii=False, indent=4)
+    return weights
+
+
+def main(input_dir: str, cache_path: Optional[str] = None, field: str = "scores") -> None:
+    file_paths = [os.path.join(input_dir, f) for f in list_result_files(input_dir)]
+    weights = load_judge_weights(file_paths, cache_path=cache_path, field=field)
+    for model, weight in sorted(weights.items(), key=lambda x: -x[1]):
+        print(f"{model}: {weight:.4f}")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -3,12 +3,35 @@ import os
 import sys
 import random
 
+from src.data import get_dialogue_id
+from src.result_format import is_result_file, list_result_files, load_result
+from src.util import save
+
 input_path = sys.argv[1]
 output_path = sys.argv[2]
+file_names = list_result_files(input_path)
+if is_result_file(output_path):
+    # Combine the shard files of one player back into a single result file
+    shards = [load_result(os.path.join(input_path, name)) for name in file_names]
+    player_names = {(s.get("player") or dict()).get("model_name") for s in shards}
+    assert len(player_names) == 1, f"Shards of different players: {player_names}"
+    save(
+        output_path=output_path,
+        outputs=[output for s in shards for output in s["outputs"]],
+        interrogator_provider=shards[0]["interrogator"],
+        judge_provider=shards[0]["judge"],
+        player_provider=shards[0]["player"],
+        version=shards[0]["version"],
+    )
+    sys.exit(0)
+
 records = []
-for name in os.listdir(input_path):
-    with open(os.path.join(input_path, name)) as r:
-        records += json.load(r)["outputs"]
+for name in file_names:
+    data = load_result(os.path.join(input_path, name))
+    player_name = (data.get("player") or dict()).get("model_name")
+    for output in data["outputs"]:
+        output["dialogue_id"] = get_dialogue_id(output, player_name)
+        records.append(output)
 random.shuffle(records)
 with open(output_path, "w") as w:
     for r in records:
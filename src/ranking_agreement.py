@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+
+FloatArray = npt.NDArray[np.float64]
+
+
+def sign_tensor(scores: FloatArray) -> Tuple[FloatArray, FloatArray]:
+    # scores: (raters, players) with NaN for missing cells
+    # returns sign(x_i - x_j) per rater (zero where a cell is missing) and the observed mask
+    observed = (~np.isnan(scores)).astype(np.float64)
+    filled = np.nan_to_num(scores, nan=0.0)
+    signs = np.sign(filled[:, :, None] - filled[:, None, :])
+    signs *= observed[:, :, None] * observed[:, None, :]
+    return signs, observed
+
+
+def kendall_matrix(scores: FloatArray) -> FloatArray:
+    # Kendall tau-b for every pair of raters, over the players both of them scored
+    signs, observed = sign_tensor(scores)
+    pair_mask = observed[:, :, None] * observed[:, None, :]
+    concordance = np.einsum("aij,bij->ab", signs, signs)
+    untied_a = np.einsum("aij,bij->ab", signs**2, pair_mask)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result: FloatArray = concordance / np.sqrt(untied_a * untied_a.T)
+    return result
+
+
+def spearman_matrix(scores: FloatArray) -> FloatArray:
+    # Spearman rho for every pair of raters, ranking only the players both of them scored
+    signs, observed = sign_tensor(scores)
+    # ranks[a, b, i]: average rank of player i by rater a among players shared with rater b
+    below = (1.0 + signs) / 2.0
+    shared = observed[:, None, :] * observed[None, :, :]
+    ranks = np.einsum("aij,abj->abi", below, shared) + 0.5
+    other = ranks.transpose(1, 0, 2)
+    counts = shared.sum(axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_a = (ranks * shared).sum(axis=2) / counts
+        mean_b = (other * shared).sum(axis=2) / counts
+        da = (ranks - mean_a[:, :, None]) * shared
+        db = (other - mean_b[:, :, None]) * shared
+        norm = np.sqrt((da**2).sum(axis=2) * (db**2).sum(axis=2))
+        result: FloatArray = (da * db).sum(axis=2) / norm
+    return result
+
+
+def mean_off_diagonal(matrix: FloatArray) -> float:
+    mask = ~np.eye(matrix.shape[-1], dtype=bool)
+    values = matrix[..., mask]
+    if np.isnan(values).all():
+        return float("nan")
+    return float(np.nanmean(values))
+
+
+def percentile_interval(values: List[float]) -> Tuple[float, float]:
+    finite = [v for v in values if not np.isnan(v)]
+    if not finite:
+        return float("nan"), float("nan")
+    ci_lower, ci_upper = np.percentile(finite, [2.5, 97.5])
+    return float(ci_lower), float(ci_upper)
+
+
+@dataclass
+class AgreementReport:
+    scores: FloatArray
+    kendall: FloatArray
+    spearman: FloatArray
+    mean_kendall: float
+    mean_kendall_ci: Tuple[float, float]
+    mean_spearman: float
+    mean_spearman_ci: Tuple[float, float]
+    stability: List[float]
+
+
+def bootstrap_scores(
+    cells: Dict[Tuple[int, int], FloatArray],
+    shape: Tuple[int, int],
+    n_bootstrap: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+) -> FloatArray:
+    # Resample dialogues inside every (rater, player) cell, returns (n_bootstrap, raters, players)
+    rng = rng if rng is not None else np.random.default_rng()
+    samples = np.full((n_bootstrap,) + shape, np.nan, dtype=np.float64)
+    for (rater, player), values in cells.items():
+        if len(values) == 0:
+            continue
+        indices = rng.integers(0, len(values), size=(n_bootstrap, len(values)))
+        samples[:, rater, player] = values[indices].mean(axis=1)
+    return samples
+
+
+def agreement_report(
+    cells: Dict[Tuple[int, int], FloatArray],
+    num_raters: int,
+    num_players: int,
+    n_bootstrap: int = 1000,
+    seed: int = 42,
+) -> AgreementReport:
+    shape = (num_raters, num_players)
+    scores = np.full(shape, np.nan, dtype=np.float64)
+    for (rater, player), values in cells.items():
+        if len(values):
+            scores[rater, player] = values.mean()
+    kendall = kendall_matrix(scores)
+    spearman = spearman_matrix(scores)
+
+    rng = np.random.default_rng(seed)
+    samples = bootstrap_scores(cells, shape, n_bootstrap=n_bootstrap, rng=rng)
+    kendall_samples = [mean_off_diagonal(kendall_matrix(s)) for s in samples]
+    spearman_samples = [mean_off_diagonal(spearman_matrix(s)) for s in samples]
+    # How often each rater's bootstrap ranking agrees with its point ranking
+    stability: List[float] = []
+    for rater in range(num_raters):
+        rater_scores = np.vstack([scores[rater][None], samples[:, rater]])
+        taus = kendall_matrix(rater_scores)[0, 1:]
+        stability.append(float(np.nanmean(taus)) if not np.isnan(taus).all() else float("nan"))
+    return AgreementReport(
+        scores=scores,
+        kendall=kendall,
+        spearman=spearman,
+        mean_kendall=mean_off_diagonal(kendall),
+        mean_kendall_ci=percentile_interval(kendall_samples),
+        mean_spearman=mean_off_diagonal(spearman),
+        mean_spearman_ci=percentile_interval(spearman_samples),
+        stability=stability,
+    )
@@ -0,0 +1,164 @@
+import os
+import json
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, BinaryIO
+
+import numpy as np
+import numpy.typing as npt
+
+
+INDEX_SUFFIX = ".idx.npz"
+OVERLAY_SUFFIX = ".overlay.jsonl"
+
+
+def build_line_offsets(path: str) -> npt.NDArray[np.int64]:
+    offsets = []
+    offset = 0
+    with open(path, "rb") as r:
+        for line in r:
+            if line.strip():
+                offsets.append(offset)
+            offset += len(line)
+    return np.array(offsets, dtype=np.int64)
+
+
+# Line offsets are persisted next to the file, records are parsed on demand.
+# Deletions and updates go to an append-only overlay until compact().
+class JsonlRecordStore:
+    def __init__(self, path: str, cache_size: int = 128) -> None:
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.overlay_path = path + OVERLAY_SUFFIX
+        self.cache_size = cache_size
+        self.cache: OrderedDict[int, Dict[str, Any]] = OrderedDict()
+        self.updates: Dict[int, Dict[str, Any]] = dict()
+        self.lock = threading.RLock()
+        self.offsets = self._load_offsets()
+        self.lines: npt.NDArray[np.int64] = np.arange(len(self.offsets), dtype=np.int64)
+        self.file: Optional[BinaryIO] = open(self.path, "rb")
+        self._replay_overlay()
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __getitem__(self, position: int) -> Dict[str, Any]:
+        return self._read(self.get_line(position))
+
+    def get_record(self, line: int) -> Dict[str, Any]:
+        return self._read(line)
+
+    def get_line(self, position: int) -> int:
+        # Line numbers are stable across deletions, unlike positions
+        return int(self.lines[position])
+
+    def __iter__(self) -> Any:
+        for position in range(len(self)):
+            yield self[position]
+
+    def _fingerprint(self) -> npt.NDArray[np.int64]:
+        stat = os.stat(self.path)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def _load_offsets(self) -> npt.NDArray[np.int64]:
+        fingerprint = self._fingerprint()
+        if os.path.exists(self.index_path):
+            with np.load(self.index_path, allow_pickle=False) as npz:
+                is_valid = {"offsets", "fingerprint"} <= set(npz.files)
+                if is_valid and np.array_equal(npz["fingerprint"], fingerprint):
+                    offsets: npt.NDArray[np.int64] = npz["offsets"]
+                    return offsets
+        offsets = build_line_offsets(self.path)
+        self._save_offsets(offsets)
+        return offsets
+
+    def _save_offsets(self, offsets: npt.NDArray[np.int64]) -> None:
+        tmp_path = self.index_path + "_tmp.npz"
+        np.savez(tmp_path, offsets=offsets, fingerprint=self._fingerprint())
+        os.replace(tmp_path, self.index_path)
+
+    def _read(self, line: int) -> Dict[str, Any]:
+        with self.lock:
+            if line in self.cache:
+                self.cache.move_to_end(line)
+                return self.cache[line]
+            assert self.file is not None
+            self.file.seek(int(self.offsets[line]))
+            record: Dict[str, Any] = json.loads(self.file.readline())
+            record.update(self.updates.get(line, dict()))
+            self.cache[line] = record
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return record
+
+    def _apply(self, op: Dict[str, Any]) -> None:
+        line = op["line"]
+        with self.lock:
+            if op["op"] == "delete":
+                self.lines = self.lines[self.lines != line]
+                self.cache.pop(line, None)
+            elif op["op"] == "update":
+                self.updates.setdefault(line, dict()).update(op["fields"])
+                if line in self.cache:
+                    self.cache[line].update(op["fields"])
+
+    def _replay_overlay(self) -> None:
+        if not os.path.exists(self.overlay_path):
+            return
+        with open(self.overlay_path, encoding="utf-8") as r:
+            ops = [json.loads(raw_op) for raw_op in r if raw_op.strip()]
+        # Ops refer to line numbers, so they only apply to the file they were made on
+        fingerprint = self._fingerprint().tolist()
+        if not ops or ops[0].get("op") != "header" or ops[0]["fingerprint"] != fingerprint:
+            stale_path = self.overlay_path + ".stale"
+            os.replace(self.overlay_path, stale_path)
+            print(f"{self.path} changed since its overlay was written, moved it to {stale_path}")
+            return
+        for op in ops[1:]:
+            self._apply(op)
+
+    def _append(self, op: Dict[str, Any]) -> None:
+        is_new = not os.path.exists(self.overlay_path)
+        with open(self.overlay_path, "a", encoding="utf-8") as w:
+            if is_new:
+                header = {"op": "header", "fingerprint": self._fingerprint().tolist()}
+                w.write(json.dumps(header) + "\n")
+            w.write(json.dumps(op, ensure_ascii=False) + "\n")
+        self._apply(op)
+
+    def delete(self, position: int) -> None:
+        self._append({"op": "delete", "line": int(self.lines[position])})
+
+    def update(self, position: int, fields: Dict[str, Any]) -> None:
+        self._append({"op": "update", "line": int(self.lines[position]), "fields": fields})
+
+    def compact(self) -> None:
+        with self.lock:
+            self._compact()
+
+    def _compact(self) -> None:
+        tmp_path = self.path + "_tmp"
+        offsets: List[int] = []
+        offset = 0
+        with open(tmp_path, "wb") as w:
+            for record in self:
+                line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                offsets.append(offset)
+                offset += len(line)
+                w.write(line)
+        self.close()
+        shutil.move(tmp_path, self.path)
+        if os.path.exists(self.overlay_path):
+            os.remove(self.overlay_path)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self._save_offsets(self.offsets)
+        self.lines = np.arange(len(self.offsets), dtype=np.int64)
+        self.updates = dict()
+        self.cache.clear()
+        self.file = open(self.path, "rb")
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
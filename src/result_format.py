@@ -0,0 +1,156 @@
+import os
+import io
+import json
+import gzip
+from typing import Any, Dict, IO, List, Optional, cast
+
+import fire  # type: ignore
+
+
+COMPACT_FORMAT = "compact"
+COMPACT_VERSION = 1
+RESULT_SUFFIXES = (".json", ".json.gz", ".json.zst")
+
+
+def is_result_file(path: str) -> bool:
+    return path.endswith(RESULT_SUFFIXES)
+
+
+def strip_result_suffix(path: str) -> str:
+    for suffix in RESULT_SUFFIXES:
+        if path.endswith(suffix):
+            return path[: -len(suffix)]
+    return os.path.splitext(path)[0]
+
+
+def get_shard_path(path: str, shard_index: int, num_shards: int) -> str:
+    # Shard workers write to their own files, e.g. player.shard3of8.json, so that they
+    # don't overwrite each other; src.merge_results combines them back
+    stem = strip_result_suffix(path)
+    return f"{stem}.shard{shard_index}of{num_shards}{path[len(stem):]}"
+
+
+def list_result_files(directory: str) -> List[str]:
+    # One file per result: a compressed twin of a .json holds the same dialogues and
+    # shares its score index, so only the most recently written of them is used
+    chosen: Dict[str, str] = dict()
+    for file_name in os.listdir(directory):
+        if not is_result_file(file_name):
+            continue
+        stem = strip_result_suffix(file_name)
+        other = chosen.get(stem)
+        file_path = os.path.join(directory, file_name)
+        if other is None or os.path.getmtime(file_path) > os.path.getmtime(
+            os.path.join(directory, other)
+        ):
+            chosen[stem] = file_name
+    return sorted(chosen.values())
+
+
+def get_compression(path: str) -> str:
+    for compression in (".gz", ".zst"):
+        if path.endswith(compression):
+            return compression
+    return ""
+
+
+def open_result(path: str, mode: str = "r", compression: Optional[str] = None) -> IO[str]:
+    assert mode in ("r", "w"), mode
+    compression = get_compression(path) if compression is None else compression
+    if compression == ".gz":
+        return cast(IO[str], gzip.open(path, mode + "t", encoding="utf-8"))
+    if compression == ".zst":
+        import zstandard  # type: ignore
+
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _table_key(record: Dict[str, Any]) -> str:
+    return json.dumps(record, sort_keys=True, ensure_ascii=False)
+
+
+def pack_result(data: Dict[str, Any]) -> Dict[str, Any]:
+    # Characters and situations are stored once, outputs refer to them by position
+    tables: Dict[str, List[Dict[str, Any]]] = {"character": [], "situation": []}
+    positions: Dict[str, Dict[str, int]] = {"character": dict(), "situation": dict()}
+    outputs = []
+    for output in data["outputs"]:
+        output = dict(output)
+        for field, table in tables.items():
+            if field not in output:
+                continue
+            key = _table_key(output[field])
+            if key not in positions[field]:
+                positions[field][key] = len(table)
+                table.append(output[field])
+            output[field] = positions[field][key]
+        outputs.append(output)
+    return {
+        **data,
+        "format": COMPACT_FORMAT,
+        "format_version": COMPACT_VERSION,
+        "characters": tables["character"],
+        "situations": tables["situation"],
+        "outputs": outputs,
+    }
+
+
+def unpack_result(data: Dict[str, Any]) -> Dict[str, Any]:
+    if data.get("format") != COMPACT_FORMAT:
+        return data
+    assert data["format_version"] == COMPACT_VERSION, data["format_version"]
+    data = dict(data)
+    data.pop("format")
+    data.pop("format_version")
+    tables = {"character": data.pop("characters"), "situation": data.pop("situations")}
+    outputs = []
+    for output in data["outputs"]:
+        output = dict(output)
+        for field, table in tables.items():
+            if field in output:
+                output[field] = table[output[field]]
+        outputs.append(output)
+    data["outputs"] = outputs
+    return data
+
+
+def load_result(path: str) -> Dict[str, Any]:
+    with open_result(path) as r:
+        data: Dict[str, Any] = json.load(r)
+    return unpack_result(data)
+
+
+def dump_result(path: str, data: Dict[str, Any], compact: bool = False) -> None:
+    tmp_path = path + "_tmp"
+    with open_result(tmp_path, "w", compression=get_compression(path)) as w:
+        if compact:
+            json.dump(pack_result(data), w, ensure_ascii=False, separators=(",", ":"))
+        else:
+            json.dump(data, w, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def convert(
+    input_path: str, output_path: str, compact: bool = True, keep_input: bool = False
+) -> None:
+    data = load_result(input_path)
+    dump_result(output_path, data, compact=compact)
+    input_size = os.path.getsize(input_path)
+    output_size = os.path.getsize(output_path)
+    print(f"{input_path} ({input_size} bytes) -> {output_path} ({output_size} bytes)")
+    # A converted twin in the same place replaces its source
+    is_twin = strip_result_suffix(os.path.abspath(input_path)) == strip_result_suffix(
+        os.path.abspath(output_path)
+    )
+    if is_twin and os.path.abspath(input_path) != os.path.abspath(output_path) and not keep_input:
+        os.remove(input_path)
+        print(f"Removed {input_path}")
+
+
+if __name__ == "__main__":
+    fire.Fire(convert)
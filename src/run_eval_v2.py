@@ -7,6 +7,7 @@ import traceback
 from typing import cast, Any, List, Dict, Tuple, Optional
 from statistics import mean
 from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
 
 import requests
@@ -18,9 +19,23 @@ from dataclasses_json import DataClassJsonMixin
 from openai import OpenAI
 from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 
-from src.util import encode_prompt, generate, parse_output, save
-from src.data import Character, ChatMessages, Situation, Settings, compose_key
-from src.run_judge import run_judge
+from src.result_format import get_shard_path, load_result
+from src.util import encode_prompt, generate, generate_choices, parse_output, save
+from src.data import (
+    Character,
+    ChatMessages,
+    Situation,
+    Settings,
+    compose_key,
+    get_language_path,
+    get_languages,
+    get_shard,
+    has_any_tag,
+    load_settings,
+    parse_shard,
+    split_list,
+)
+from src.run_judge import JudgeOutput, JudgeSingleOutput, run_judge
 from src.provider import LLMProvider
 
 
@@ -29,15 +44,17 @@ class InterrogatorOutput(DataClassJsonMixin):
     next_utterance: str
 
 
-def run_player(
+def run_player_samples(
     character: Character,
     messages: ChatMessages,
     provider: LLMProvider,
     character_prompt_path: str,
-) -> str:
-    system_message = encode_prompt(character_prompt_path, character=character)
+    num_samples: int = 1,
+    character_card: Optional[str] = None,
+) -> List[str]:
+    system_message = character_card or encode_prompt(character_prompt_path, character=character)
     messages = [{"role": "system", "content": system_message}] + messages
-    output = None
+    outputs: List[str] = []
     for _ in range(2):
         try:
             print("======PLAYER======")
@@ -45,14 +62,23 @@ def run_player(
                 print(f'{m["role"]}: {m["content"]}')
                 print()
             print()
-            output = generate(
+            outputs = generate_choices(
                 provider=provider,
                 messages=messages,
+                n=num_samples,
                 **provider.params,
             )
-            assert output.strip() and len(output.strip()) >= 2
-            print(output)
-            print()
+            # Endpoints that ignore "n" get one request per missing sample, each with its own
+            # seed, otherwise seed-honouring endpoints return the same sample every time
+            while len(outputs) < num_samples:
+                params = dict(provider.params)
+                if "seed" in params:
+                    params["seed"] = params["seed"] + len(outputs)
+                outputs.append(generate(provider=provider, messages=messages, **params))
+            for output in outputs:
+                assert output.strip() and len(output.strip()) >= 2
+                print(output)
+                print()
             print("=============")
             print()
             print()
@@ -61,8 +87,24 @@ def run_player(
             time.sleep(10)
             continue
         break
-    assert output is not None
-    return output
+    assert len(outputs) >= num_samples
+    return outputs[:num_samples]
+
+
+def run_player(
+    character: Character,
+    messages: ChatMessages,
+    provider: LLMProvider,
+    character_prompt_path: str,
+    character_card: Optional[str] = None,
+) -> str:
+    return run_player_samples(
+        character=character,
+        messages=messages,
+        provider=provider,
+        character_prompt_path=character_prompt_path,
+        character_card=character_card,
+    )[0]
 
 
 def run_interrogator(
@@ -76,7 +118,7 @@ def run_interrogator(
     **kwargs: Any,
 ) -> InterrogatorOutput:
     system_prompt = encode_prompt(system_prompt_path)
-    assert character.summary
+    assert character.summary, f"No summary for {character.char_name}, see src.compile_settings"
     user_prompt = encode_prompt(
         user_prompt_path,
         char_summary=character.summary,
@@ -120,48 +162,127 @@ def process_situation(
     player_provider: LLMProvider,
     interrogator_provider: LLMProvider,
     judge_provider: LLMProvider,
+    incremental_judge: bool = False,
+    stop_on_refusal: bool = False,
+    prefix: Optional[ChatMessages] = None,
 ) -> Dict[str, Any]:
-    messages: ChatMessages = []
-    for turn in range(situation.num_turns):
-        output = run_interrogator(
+    def judge(messages: ChatMessages, turns: Optional[List[int]] = None) -> JudgeOutput:
+        return run_judge(
             character=character,
             situation=situation,
             messages=messages,
-            user_prompt_path=settings.interrogator_user_prompt_path,
-            system_prompt_path=settings.interrogator_system_prompt_path,
-            character_prompt_path=settings.character_prompt_path,
-            provider=interrogator_provider,
-        )
-        messages.append({"role": "user", "content": output.next_utterance})
-        bot_message = run_player(
-            provider=player_provider,
-            messages=messages,
-            character=character,
+            user_prompt_path=settings.judge_user_prompt_path,
+            system_prompt_path=settings.judge_system_prompt_path,
             character_prompt_path=settings.character_prompt_path,
+            character_card=settings.get_card(character),
+            provider=judge_provider,
+            turns=turns,
+            temperature=0.1,
+            top_p=0.95,
+            max_tokens=4096,
         )
-        assert bot_message.strip()
-        messages.append({"role": "assistant", "content": bot_message})
-    judge_output = run_judge(
-        character=character,
-        situation=situation,
-        messages=messages,
-        user_prompt_path=settings.judge_user_prompt_path,
-        system_prompt_path=settings.judge_system_prompt_path,
-        character_prompt_path=settings.character_prompt_path,
-        provider=judge_provider,
-        temperature=0.1,
-        top_p=0.95,
-        max_tokens=4096,
-    )
-    final_output = {
+
+    def get_turn_score(judgement: Future[JudgeOutput]) -> Optional[JudgeSingleOutput]:
+        # A failed per-turn judge call leaves its turn unscored, like the batch judge does
+        if judgement.exception() is not None:
+            return None
+        return judgement.result().scores[0]
+
+    # In the incremental mode every player turn is judged in the background while the
+    # interrogator writes the next utterance. Judge prompts for consecutive turns share
+    # the conversation as a prefix, so providers with prompt caching reuse it.
+    # With stop_on_refusal the dialogue ends once a judged turn is a refusal.
+    turn_judgements: List[Future[JudgeOutput]] = []
+    messages: ChatMessages = list(prefix) if prefix else []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        if incremental_judge:
+            for turn in range(len(messages) // 2):
+                turn_judgements.append(executor.submit(judge, messages[: 2 * turn + 2], [turn + 1]))
+        for turn in range(len(messages) // 2, situation.num_turns):
+            output = run_interrogator(
+                character=character,
+                situation=situation,
+                messages=messages,
+                user_prompt_path=settings.interrogator_user_prompt_path,
+                system_prompt_path=settings.interrogator_system_prompt_path,
+                character_prompt_path=settings.character_prompt_path,
+                provider=interrogator_provider,
+            )
+            # Waiting for all earlier judgements, which ran alongside the interrogator,
+            # keeps the stopping point independent of how fast the judge answers
+            turn_scores = [get_turn_score(f) for f in turn_judgements]
+            if stop_on_refusal and any(s is not None and s.is_refusal for s in turn_scores):
+                break
+            messages.append({"role": "user", "content": output.next_utterance})
+            bot_message = run_player(
+                provider=player_provider,
+                messages=messages,
+                character=character,
+                character_prompt_path=settings.character_prompt_path,
+                character_card=settings.get_card(character),
+            )
+            assert bot_message.strip()
+            messages.append({"role": "assistant", "content": bot_message})
+            if incremental_judge:
+                turn_judgements.append(executor.submit(judge, list(messages), [turn + 1]))
+        if incremental_judge:
+            turn_scores = [get_turn_score(f) for f in turn_judgements]
+            judge_output = JudgeOutput(
+                scores=[s for s in turn_scores if s is not None],
+                missing_turns=[i + 1 for i, s in enumerate(turn_scores) if s is None],
+            )
+            assert judge_output.scores, "No valid scores in the judge outputs"
+            if judge_output.missing_turns:
+                print(f"No scores for turns {judge_output.missing_turns}, keeping the other turns")
+        else:
+            judge_output = judge(messages)
+    final_output: Dict[str, Any] = {
         "messages": messages,
         "character": character.to_dict(),
         "situation": situation.to_dict(),
         "scores": judge_output.get_aggregated(),
     }
+    if judge_output.missing_turns:
+        final_output["scores_missing_turns"] = judge_output.missing_turns
     return final_output
 
 
+def start_branches(
+    character: Character,
+    situation: Situation,
+    settings: Settings,
+    player_provider: LLMProvider,
+    interrogator_provider: LLMProvider,
+    num_branches: int,
+) -> List[ChatMessages]:
+    # Branches share the opening utterance, so the first player turn is a single request with n
+    output = run_interrogator(
+        character=character,
+        situation=situation,
+        messages=[],
+        user_prompt_path=settings.interrogator_user_prompt_path,
+        system_prompt_path=settings.interrogator_system_prompt_path,
+        character_prompt_path=settings.character_prompt_path,
+        provider=interrogator_provider,
+    )
+    messages: ChatMessages = [{"role": "user", "content": output.next_utterance}]
+    bot_messages = run_player_samples(
+        provider=player_provider,
+        messages=messages,
+        character=character,
+        character_prompt_path=settings.character_prompt_path,
+        character_card=settings.get_card(character),
+        num_samples=num_branches,
+    )
+    return [messages + [{"role": "assistant", "content": m}] for m in bot_messages]
+
+
+def with_seed(provider: LLMProvider, seed: int) -> LLMProvider:
+    provider = copy.copy(provider)
+    provider.params = {**provider.params, "seed": seed}
+    return provider
+
+
 def run_eval(
     providers_path: str,
     settings_path: str,
@@ -171,70 +292,181 @@ def run_eval(
     judge_name: str,
     language: str = "ru",
     every_x: int = 1,
+    compact: bool = False,
+    incremental_judge: bool = False,
+    stop_on_refusal: bool = False,
+    pipeline_width: int = 1,
+    samples: int = 1,
+    batch_samples: bool = False,
+    seed: int = 42,
+    character_tags: Optional[str] = None,
+    situation_tags: Optional[str] = None,
+    characters: Optional[str] = None,
+    situations: Optional[str] = None,
+    shard: Optional[str] = None,
 ) -> None:
+    # Refusals are only known before the dialogue ends when turns are judged as they come
+    assert incremental_judge or not stop_on_refusal, "--stop-on-refusal needs --incremental-judge"
     with open(providers_path, encoding="utf-8") as r:
         providers = {name: LLMProvider(**provider) for name, provider in json.load(r).items()}
-    with open(settings_path, encoding="utf-8") as r:
-        settings = Settings.from_dict(json.load(r)[language])
-
-    outputs = []
-    existing_keys = set()
-    if os.path.exists(output_path):
-        with open(output_path, encoding="utf-8") as r:
-            outputs = json.load(r)["outputs"]
-            for output in outputs:
-                character = Character.from_dict(output["character"])
-                situation = Situation.from_dict(output["situation"])
-                record_key = compose_key(character=character, situation=situation)
-                existing_keys.add(record_key)
-
-    print(f"Existing situations: {len(outputs)}")
-
     interrogator_provider = copy.copy(providers[interrogator_name])
     interrogator_provider.params = {"temperature": 0.8, "top_p": 0.95, "max_tokens": 1024}
     player_provider = copy.copy(providers[player_name])
     judge_provider = copy.copy(providers[judge_name])
     judge_provider.params = {"temperature": 0.1, "top_p": 0.95, "max_tokens": 4096}
+    languages = get_languages(settings_path, language)
+
+    # Tags and lists narrow the grid, situations are referred to by their position.
+    # A shard takes the pairs whose compose_key hash falls into it, so workers with
+    # the same settings and different shards split the grid without overlap.
+    selected_character_tags = split_list(character_tags) if character_tags else None
+    selected_situation_tags = split_list(situation_tags) if situation_tags else None
+    selected_characters = split_list(characters) if characters is not None else None
+    selected_situations = [int(i) for i in split_list(situations)] if situations is not None else None
+    shard_index, num_shards = parse_shard(shard) if shard else (0, 1)
+
+    def run_language(language: str) -> None:
+        settings = load_settings(settings_path, language)
+        language_output_path = get_language_path(output_path, language, len(languages))
+        if num_shards > 1:
+            language_output_path = get_shard_path(language_output_path, shard_index, num_shards)
+
+        outputs = []
+        existing_keys = set()
+        if os.path.exists(language_output_path):
+            outputs = load_result(language_output_path)["outputs"]
+            for output in outputs:
+                character = Character.from_dict(output["character"])
+                situation = Situation.from_dict(output["situation"])
+                record_key = compose_key(character=character, situation=situation)
+                existing_keys.add((record_key, output.get("sample", 0)))
 
-    total_iterations = len(settings.characters) * len(settings.situations)
-    with tqdm(total=total_iterations, desc="Processing pairs") as pbar:
+        print(f"Existing situations ({language}): {len(outputs)}")
+
+        # Every pair yields one dialogue per sample. A unit of work is a pair with the samples
+        # it still misses: one sample each, or all of them with batch_samples.
+        pairs: List[Tuple[Character, Situation, List[int]]] = []
         index = -2
         for character in settings.characters:
             index += 1
-
-            for situation in settings.situations:
+            is_character_selected = has_any_tag(character.tags, selected_character_tags) and (
+                selected_characters is None or character.char_name in selected_characters
+            )
+            for situation_index, situation in enumerate(settings.situations):
                 index += 1
-                pbar.update(1)
-
-                if index % every_x != 0:
+                if index % every_x != 0 or not is_character_selected:
+                    continue
+                if selected_situations is not None and situation_index not in selected_situations:
+                    continue
+                if not has_any_tag(situation.tags, selected_situation_tags):
                     continue
                 record_key = compose_key(character=character, situation=situation)
-                if record_key in existing_keys:
+                if get_shard(record_key, num_shards) != shard_index:
+                    continue
+                sample_ids = [i for i in range(samples) if (record_key, i) not in existing_keys]
+                if not sample_ids:
                     print(f"Existing key: {record_key}")
                     continue
-                try:
-                    final_output = process_situation(
+                if batch_samples:
+                    pairs.append((character, situation, sample_ids))
+                else:
+                    pairs.extend((character, situation, [i]) for i in sample_ids)
+
+        def run_pair(pair: Tuple[Character, Situation, List[int]]) -> List[Dict[str, Any]]:
+            character, situation, sample_ids = pair
+            prefixes: List[Optional[ChatMessages]] = [None] * len(sample_ids)
+            if len(sample_ids) > 1:
+                prefixes = list(
+                    start_branches(
                         character=character,
                         situation=situation,
                         settings=settings,
-                        player_provider=player_provider,
-                        interrogator_provider=interrogator_provider,
-                        judge_provider=judge_provider,
+                        player_provider=with_seed(player_provider, seed),
+                        interrogator_provider=with_seed(interrogator_provider, seed),
+                        num_branches=len(sample_ids),
                     )
-                    outputs.append(final_output)
-                except Exception:
-                    traceback.print_exc()
-                    time.sleep(30)
-                    continue
-
-                save(
-                    output_path=output_path,
-                    outputs=outputs,
-                    interrogator_provider=interrogator_provider.to_dict(),
-                    judge_provider=judge_provider.to_dict(),
-                    player_provider=player_provider.to_dict(),
-                    version=settings.version,
                 )
+            pair_outputs = []
+            for sample, prefix in zip(sample_ids, prefixes):
+                # A single sample keeps the providers' own parameters, extra samples are seeded
+                is_seeded = samples > 1
+                output = process_situation(
+                    character=character,
+                    situation=situation,
+                    settings=settings,
+                    player_provider=(
+                        with_seed(player_provider, seed + sample) if is_seeded else player_provider
+                    ),
+                    interrogator_provider=(
+                        with_seed(interrogator_provider, seed + sample)
+                        if is_seeded
+                        else interrogator_provider
+                    ),
+                    judge_provider=judge_provider,
+                    incremental_judge=incremental_judge,
+                    stop_on_refusal=stop_on_refusal,
+                    prefix=prefix,
+                )
+                if is_seeded:
+                    output["sample"] = sample
+                pair_outputs.append(output)
+            return pair_outputs
+
+        def run_pair_with_backoff(
+            pair: Tuple[Character, Situation, List[int]]
+        ) -> List[Dict[str, Any]]:
+            # Same backoff as the sequential loop: a failed dialogue keeps its worker busy,
+            # so a failing provider is not retried by every worker at full speed
+            try:
+                return run_pair(pair)
+            except Exception:
+                time.sleep(30)
+                raise
+
+        def save_outputs() -> None:
+            save(
+                output_path=language_output_path,
+                outputs=outputs,
+                interrogator_provider=interrogator_provider.to_dict(),
+                judge_provider=judge_provider.to_dict(),
+                player_provider=player_provider.to_dict(),
+                version=settings.version,
+                compact=compact,
+            )
+
+        with tqdm(total=len(pairs), desc=f"Processing pairs ({language})") as pbar:
+            if pipeline_width <= 1:
+                for pair in pairs:
+                    pbar.update(1)
+                    try:
+                        outputs.extend(run_pair(pair))
+                    except Exception:
+                        traceback.print_exc()
+                        time.sleep(30)
+                        continue
+                    save_outputs()
+                return
+
+            # Several dialogues are in flight at once, each one still strictly turn by turn,
+            # so the interrogator serves one dialogue while the player answers in another.
+            # Outputs are saved from this thread in completion order.
+            with ThreadPoolExecutor(max_workers=pipeline_width) as executor:
+                futures = [executor.submit(run_pair_with_backoff, pair) for pair in pairs]
+                for future in as_completed(futures):
+                    pbar.update(1)
+                    try:
+                        outputs.extend(future.result())
+                    except Exception:
+                        traceback.print_exc()
+                        continue
+                    save_outputs()
+
+    # Languages share the providers and so their HTTP connection pools
+    if len(languages) == 1:
+        run_language(languages[0])
+        return
+    with ThreadPoolExecutor(max_workers=len(languages)) as executor:
+        list(executor.map(run_language, languages))
 
 
 if __name__ == "__main__":
@@ -7,13 +7,23 @@ import time
 from typing import List, Any, Optional, Dict
 from statistics import mean
 from collections import defaultdict
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
 import fire  # type: ignore
 from scipy.stats import spearmanr  # type: ignore
 from dataclasses_json import DataClassJsonMixin
 
-from src.data import Character, Situation, ChatMessages, Settings, compose_key
+from src.data import (
+    Character,
+    ChatMessages,
+    Situation,
+    compose_key,
+    get_language_path,
+    get_languages,
+    load_settings,
+)
+from src.result_format import is_result_file, load_result
 from src.util import encode_prompt, generate, parse_output, save
 from src.provider import LLMProvider
 
@@ -33,6 +43,8 @@ class JudgeSingleOutput(DataClassJsonMixin):
 @dataclass
 class JudgeOutput(DataClassJsonMixin):
     scores: List[JudgeSingleOutput]
+    # Player turns the judge never scored, the scores above skip them
+    missing_turns: List[int] = field(default_factory=list)
 
     def get_aggregated(self) -> Dict[str, List[int]]:
         fixed_scores = defaultdict(list)
@@ -44,6 +56,26 @@ class JudgeOutput(DataClassJsonMixin):
         return fixed_scores
 
 
+def parse_judge_scores(output: str, turns: List[int]) -> Dict[int, JudgeSingleOutput]:
+    # Keeps every valid per-turn entry, entries without "turn" are matched by position
+    record = parse_output(output)
+    entries = record.get("scores")
+    if not isinstance(entries, list):
+        return dict()
+    scores: Dict[int, JudgeSingleOutput] = dict()
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            continue
+        try:
+            turn = int(entry.get("turn", turns[position] if position < len(turns) else -1))
+            single_output = JudgeSingleOutput.from_dict(entry)
+        except Exception:
+            continue
+        if turn in turns and turn not in scores:
+            scores[turn] = single_output
+    return scores
+
+
 def run_judge(
     character: Character,
     situation: Situation,
@@ -52,38 +84,59 @@ def run_judge(
     user_prompt_path: str,
     character_prompt_path: str,
     provider: LLMProvider,
+    missing_turns_prompt_path: str = "templates/v2/judge_missing_turns.jinja",
+    turns: Optional[List[int]] = None,
+    character_card: Optional[str] = None,
     **kwargs: Any,
 ) -> JudgeOutput:
-    char_description = encode_prompt(character_prompt_path, character=character)
+    char_description = character_card or encode_prompt(character_prompt_path, character=character)
     system_prompt = encode_prompt(system_prompt_path)
     user_prompt = encode_prompt(
         user_prompt_path,
         char_description=char_description,
         situation=situation.text,
         messages=messages,
+        turns=turns,
     )
     prompt = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt},
     ]
-    output: Optional[JudgeOutput] = None
+    num_turns = sum(1 for m in messages if m["role"] == "assistant")
+    expected_turns = turns or list(range(1, num_turns + 1))
+    missing_turns = list(expected_turns)
+    scores: Dict[int, JudgeSingleOutput] = dict()
+    request = prompt
     for _ in range(3):
         try:
-            print(prompt[0]["content"])
-            print(prompt[1]["content"])
-            result = generate(prompt, provider=provider, **kwargs)
+            print(request[0]["content"])
+            print(request[-1]["content"])
+            result = generate(request, provider=provider, **kwargs)
             print(result)
             print()
             print("=============")
             print()
-            output = JudgeOutput.from_dict(parse_output(result))
-            break
+            scores.update(parse_judge_scores(result, missing_turns))
+            missing_turns = [turn for turn in missing_turns if turn not in scores]
+            if not missing_turns:
+                break
+            # Re-ask only for the missing turns, keeping the conversation as a shared prefix
+            follow_up = encode_prompt(missing_turns_prompt_path, turns=missing_turns)
+            request = prompt + [
+                {"role": "assistant", "content": result},
+                {"role": "user", "content": follow_up},
+            ]
         except Exception:
             traceback.print_exc()
             time.sleep(10)
             continue
-    assert output is not None
-    return output
+    assert scores, "No valid scores in the judge output"
+    if missing_turns:
+        print(f"No scores for turns {missing_turns}, keeping the other turns")
+    return JudgeOutput(
+        scores=[scores[turn] for turn in expected_turns if turn in scores],
+        missing_turns=missing_turns,
+    )
 
 
 def main(
@@ -94,73 +147,87 @@ def main(
     judge_name: str,
     language: str = "ru",
     output_key: str = "scores",
+    compact: bool = False,
 ) -> None:
     with open(providers_path, encoding="utf-8") as r:
         providers = {name: LLMProvider(**provider) for name, provider in json.load(r).items()}
-    with open(settings_path, encoding="utf-8") as r:
-        settings = Settings.from_dict(json.load(r)[language])
-
     judge_provider = copy.copy(providers[judge_name])
     judge_provider.params = {"temperature": 0.1, "top_p": 0.95, "max_tokens": 4096}
-
-    global_params = dict()
-    with open(input_path) as r:
-        if input_path.endswith(".jsonl"):
-            records = [json.loads(line) for line in r]
-        elif input_path.endswith(".json"):
-            global_params = json.load(r)
+    languages = get_languages(settings_path, language)
+
+    def judge_language(language: str) -> None:
+        settings = load_settings(settings_path, language)
+        language_input_path = get_language_path(input_path, language, len(languages))
+        language_output_path = get_language_path(output_path, language, len(languages))
+
+        global_params = dict()
+        if language_input_path.endswith(".jsonl"):
+            with open(language_input_path) as r:
+                records = [json.loads(line) for line in r]
+        elif is_result_file(language_input_path):
+            global_params = load_result(language_input_path)
             records = global_params.pop("outputs")
 
-    outputs = []
-    existing_keys = set()
-    if os.path.exists(output_path):
-        with open(output_path, encoding="utf-8") as r:
-            data = json.load(r)
-            outputs = data["outputs"]
+        outputs = []
+        existing_keys = set()
+        if os.path.exists(language_output_path):
+            outputs = load_result(language_output_path)["outputs"]
             for output in outputs:
                 character = Character.from_dict(output["character"])
                 situation = Situation.from_dict(output["situation"])
                 record_key = compose_key(character=character, situation=situation)
                 player_name = output.get("player", dict()).get("model_name")
-                existing_keys.add((record_key, player_name))
-
-    for i, record in enumerate(records):
-        character = Character.from_dict(record["character"])
-        situation = Situation.from_dict(record["situation"])
-        record_key = compose_key(character=character, situation=situation)
-        player_name = record.get("player", dict()).get("model_name")
-        if (record_key, player_name) in existing_keys:
-            print(f"Existing key: {record_key}")
-            continue
-
-        messages = record["messages"]
-        record.pop("scores", None)
-        try:
-            output = run_judge(
-                character=character,
-                situation=situation,
-                messages=messages,
-                user_prompt_path=settings.judge_user_prompt_path,
-                system_prompt_path=settings.judge_system_prompt_path,
-                character_prompt_path=settings.character_prompt_path,
-                provider=judge_provider,
+                existing_keys.add((record_key, player_name, output.get("sample", 0)))
+
+        for i, record in enumerate(records):
+            character = Character.from_dict(record["character"])
+            situation = Situation.from_dict(record["situation"])
+            record_key = compose_key(character=character, situation=situation)
+            player_name = record.get("player", dict()).get("model_name")
+            if (record_key, player_name, record.get("sample", 0)) in existing_keys:
+                print(f"Existing key: {record_key}")
+                continue
+
+            messages = record["messages"]
+            record.pop("scores", None)
+            try:
+                output = run_judge(
+                    character=character,
+                    situation=situation,
+                    messages=messages,
+                    user_prompt_path=settings.judge_user_prompt_path,
+                    system_prompt_path=settings.judge_system_prompt_path,
+                    character_prompt_path=settings.character_prompt_path,
+                    character_card=settings.get_card(character),
+                    provider=judge_provider,
+                )
+            except Exception:
+                continue
+
+            fixed_scores = output.get_aggregated()
+            record[output_key] = fixed_scores
+            record.pop(f"{output_key}_missing_turns", None)
+            if output.missing_turns:
+                record[f"{output_key}_missing_turns"] = output.missing_turns
+            outputs.append(record)
+
+            save(
+                output_path=language_output_path,
+                outputs=outputs,
+                judge_provider=judge_provider.to_dict(),
+                interrogator_provider=global_params.get("interrogator"),
+                player_provider=global_params.get("player"),
+                version=global_params.get("version"),
+                score_key=output_key,
+                compact=compact,
             )
-        except Exception:
-            continue
 
-        fixed_scores = output.get_aggregated()
-        record[output_key] = fixed_scores
-        outputs.append(record)
-
-        save(
-            output_path=output_path,
-            outputs=outputs,
-            judge_provider=judge_provider.to_dict(),
-            interrogator_provider=global_params.get("interrogator"),
-            player_provider=global_params.get("player"),
-            version=global_params.get("version"),
-            score_key=output_key,
-        )
+    # Languages share the judge provider and so its HTTP connection pool
+    if len(languages) == 1:
+        judge_language(languages[0])
+        return
+    with ThreadPoolExecutor(max_workers=len(languages)) as executor:
+        list(executor.map(judge_language, languages))
 
 
 if __name__ == "__main__":
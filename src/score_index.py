@@ -0,0 +1,181 @@
+import os
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+import fire  # type: ignore
+import numpy as np
+import numpy.typing as npt
+
+from src.data import get_dialogue_id
+from src.result_format import list_result_files, load_result, strip_result_suffix
+
+
+INDEX_SUFFIX = ".scores.npz"
+INDEX_VERSION = 2
+META_FIELDS = ("version", "judge", "interrogator", "player", "refusal_ratio", "final_score")
+
+
+def get_index_path(result_path: str) -> str:
+    return strip_result_suffix(result_path) + INDEX_SUFFIX
+
+
+def _model_name(record: Dict[str, Any], field: str, default: str = "") -> str:
+    value = record.get(field)
+    if isinstance(value, dict):
+        return str(value.get("model_name", default))
+    return default
+
+
+def _to_row(value: Any) -> List[float]:
+    if isinstance(value, list):
+        return [float(v) for v in value]
+    if isinstance(value, (int, float)):
+        return [float(value)]
+    return []
+
+
+@dataclass
+class ScoreIndex:
+    # Dialogue IDs, see src.data.compose_dialogue_id
+    keys: npt.NDArray[np.str_]
+    players: npt.NDArray[np.str_]
+    judges: npt.NDArray[np.str_]
+    characters: npt.NDArray[np.str_]
+    situations: npt.NDArray[np.str_]
+    assistant_chars: npt.NDArray[np.int64]
+    assistant_turns: npt.NDArray[np.int64]
+    # score field ("scores", "new_scores", "human_scores") -> metric -> (n, max_turns), NaN-padded
+    scores: Dict[str, Dict[str, npt.NDArray[np.float64]]]
+    meta: Dict[str, Any]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def from_result(cls, data: Dict[str, Any]) -> "ScoreIndex":
+        outputs = data["outputs"]
+        file_player = _model_name(data, "player")
+        file_judge = _model_name(data, "judge")
+        rows: Dict[str, Dict[str, List[List[float]]]] = dict()
+        for i, output in enumerate(outputs):
+            for field, field_scores in output.items():
+                if not field.endswith("scores") or not isinstance(field_scores, dict):
+                    continue
+                for metric, value in field_scores.items():
+                    if "explanation" in metric:
+                        continue
+                    metric_rows = rows.setdefault(field, dict()).setdefault(metric, [[]] * len(outputs))
+                    metric_rows[i] = _to_row(value)
+
+        scores: Dict[str, Dict[str, npt.NDArray[np.float64]]] = dict()
+        for field, metrics in rows.items():
+            scores[field] = dict()
+            for metric, metric_rows in metrics.items():
+                width = max(1, max(len(r) for r in metric_rows))
+                matrix = np.full((len(outputs), width), np.nan, dtype=np.float64)
+                for i, row in enumerate(metric_rows):
+                    matrix[i, : len(row)] = row
+                scores[field][metric] = matrix
+
+        assistant_lengths = [
+            [len(m["content"]) for m in o["messages"] if m["role"] == "assistant"] for o in outputs
+        ]
+        return cls(
+            keys=np.array([get_dialogue_id(o, file_player) for o in outputs], dtype=np.str_),
+            players=np.array([_model_name(o, "player", file_player) for o in outputs], dtype=np.str_),
+            judges=np.array([_model_name(o, "judge", file_judge) for o in outputs], dtype=np.str_),
+            characters=np.array([o["character"]["char_name"] for o in outputs], dtype=np.str_),
+            situations=np.array([o["situation"]["text"] for o in outputs], dtype=np.str_),
+            assistant_chars=np.array([sum(lengths) for lengths in assistant_lengths], dtype=np.int64),
+            assistant_turns=np.array([len(lengths) for lengths in assistant_lengths], dtype=np.int64),
+            scores=scores,
+            meta={k: data.get(k) for k in META_FIELDS},
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "ScoreIndex":
+        with np.load(path, allow_pickle=False) as npz:
+            scores: Dict[str, Dict[str, npt.NDArray[np.float64]]] = dict()
+            for name in npz.files:
+                if not name.startswith("scores/"):
+                    continue
+                _, field, metric = name.split("/", 2)
+                scores.setdefault(field, dict())[metric] = npz[name]
+            return cls(
+                keys=npz["keys"],
+                players=npz["players"],
+                judges=npz["judges"],
+                characters=npz["characters"],
+                situations=npz["situations"],
+                assistant_chars=npz["assistant_chars"],
+                assistant_turns=npz["assistant_turns"],
+                scores=scores,
+                meta=json.loads(str(npz["meta"])),
+            )
+
+    def save(self, path: str) -> None:
+        arrays: Dict[str, Any] = {
+            "index_version": np.array(INDEX_VERSION),
+            "keys": self.keys,
+            "players": self.players,
+            "judges": self.judges,
+            "characters": self.characters,
+            "situations": self.situations,
+            "assistant_chars": self.assistant_chars,
+            "assistant_turns": self.assistant_turns,
+            "meta": np.array(json.dumps(self.meta, ensure_ascii=False)),
+        }
+        for field, metrics in self.scores.items():
+            for metric, matrix in metrics.items():
+                arrays[f"scores/{field}/{metric}"] = matrix
+        tmp_path = path + "_tmp.npz"
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    def metrics(self, field: str = "scores") -> List[str]:
+        return list(self.scores.get(field, dict()).keys())
+
+    def mean_scores(self, metric: str, field: str = "scores") -> npt.NDArray[np.float64]:
+        matrix = self.scores[field][metric]
+        result = np.full(len(matrix), np.nan, dtype=np.float64)
+        mask = ~np.isnan(matrix).all(axis=1)
+        result[mask] = np.nanmean(matrix[mask], axis=1)
+        return result
+
+    def refusals(self, field: str = "scores") -> npt.NDArray[np.bool_]:
+        if "is_refusal" not in self.scores.get(field, dict()):
+            return np.zeros(len(self), dtype=np.bool_)
+        matrix = self.scores[field]["is_refusal"]
+        result: npt.NDArray[np.bool_] = np.nan_to_num(matrix, nan=0.0).max(axis=1) == 1
+        return result
+
+
+def write_score_index(result_path: str, data: Dict[str, Any]) -> ScoreIndex:
+    index = ScoreIndex.from_result(data)
+    index.save(get_index_path(result_path))
+    return index
+
+
+def load_score_index(result_path: str, rebuild: bool = False) -> ScoreIndex:
+    index_path = get_index_path(result_path)
+    is_fresh = os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(
+        result_path
+    )
+    if is_fresh and not rebuild:
+        with np.load(index_path, allow_pickle=False) as npz:
+            is_fresh = int(npz["index_version"]) == INDEX_VERSION
+    if is_fresh and not rebuild:
+        return ScoreIndex.load(index_path)
+    return write_score_index(result_path, load_result(result_path))
+
+
+def build_indices(results_dir: str, rebuild: bool = False) -> None:
+    for file_name in list_result_files(results_dir):
+        file_path = os.path.join(results_dir, file_name)
+        index = load_score_index(file_path, rebuild=rebuild)
+        print(f"{file_path}: {len(index)} outputs")
+
+
+if __name__ == "__main__":
+    fire.Fire(build_indices)
@@ -0,0 +1,212 @@
+import os
+import json
+import mmap
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+import fire  # type: ignore
+import numpy as np
+import numpy.typing as npt
+
+from src.result_format import list_result_files, load_result
+from src.score_index import ScoreIndex
+
+
+# Not ".idx.npz", which is the offsets sidecar of src.record_store
+INDEX_SUFFIX = ".tidx.npz"
+INDEX_VERSION = 1
+STORE_FIELDS = ("keys", "sources", "players", "judges", "interrogators", "final_scores", "refusals")
+
+
+def _model_name(value: Any) -> str:
+    if isinstance(value, dict):
+        return str(value.get("model_name", ""))
+    return ""
+
+
+def _final_scores(index: ScoreIndex, field: str = "scores") -> npt.NDArray[np.float64]:
+    metrics = [m for m in index.metrics(field) if "refusal" not in m]
+    if not metrics:
+        return np.full(len(index), np.nan, dtype=np.float64)
+    totals = [index.mean_scores(m, field) for m in metrics]
+    result: npt.NDArray[np.float64] = np.mean(totals, axis=0)
+    return result
+
+
+# One JSON line per dialogue in an append-only data file, read through mmap.
+# The index keeps byte offsets and the per-dialogue fields analysis jobs filter on,
+# so selecting dialogues never parses the transcripts themselves.
+class TranscriptStore:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.lock = threading.RLock()
+        if not os.path.exists(self.path):
+            open(self.path, "wb").close()
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.fields: Dict[str, npt.NDArray[Any]] = dict()
+        self.source_fingerprints: Dict[str, List[int]] = dict()
+        self._load_index()
+        self._by_key: Optional[Dict[str, List[int]]] = None
+        self.mmap: Optional[mmap.mmap] = None
+        self._remap()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position: int) -> Dict[str, Any]:
+        assert self.mmap is not None
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        record: Dict[str, Any] = json.loads(self.mmap[start:end])
+        return record
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for position in range(len(self)):
+            yield self[position]
+
+    def _empty_fields(self) -> Dict[str, npt.NDArray[Any]]:
+        return {
+            "keys": np.array([], dtype=np.str_),
+            "sources": np.array([], dtype=np.str_),
+            "players": np.array([], dtype=np.str_),
+            "judges": np.array([], dtype=np.str_),
+            "interrogators": np.array([], dtype=np.str_),
+            "final_scores": np.array([], dtype=np.float64),
+            "refusals": np.array([], dtype=np.bool_),
+        }
+
+    def _load_index(self) -> None:
+        self.fields = self._empty_fields()
+        if not os.path.exists(self.index_path):
+            if os.path.getsize(self.path) != 0:
+                raise ValueError(f"No index for non-empty transcript store {self.path}")
+            return
+        with np.load(self.index_path, allow_pickle=False) as npz:
+            if "index_version" not in npz.files:
+                raise ValueError(f"{self.index_path} is not a transcript store index")
+            if int(npz["index_version"]) != INDEX_VERSION:
+                raise ValueError(f"Unsupported transcript index version in {self.index_path}")
+            self.offsets = npz["offsets"]
+            for name in STORE_FIELDS:
+                self.fields[name] = npz[name]
+            self.source_fingerprints = json.loads(str(npz["source_fingerprints"]))
+        # Drop a tail that was written without its index, e.g. after a crash mid-append
+        if os.path.getsize(self.path) != int(self.offsets[-1]):
+            with open(self.path, "r+b") as f:
+                f.truncate(int(self.offsets[-1]))
+
+    def _save_index(self) -> None:
+        arrays: Dict[str, Any] = {
+            "index_version": np.array(INDEX_VERSION),
+            "offsets": self.offsets,
+            "source_fingerprints": np.array(
+                json.dumps(self.source_fingerprints, ensure_ascii=False)
+            ),
+            **self.fields,
+        }
+        tmp_path = self.index_path + "_tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.index_path)
+
+    def _remap(self) -> None:
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if len(self) == 0:
+            return
+        with open(self.path, "rb") as r:
+            self.mmap = mmap.mmap(r.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, dialogue_id: str) -> List[Dict[str, Any]]:
+        # The same dialogue can be stored more than once, e.g. scored by several judges
+        with self.lock:
+            if self._by_key is None:
+                self._by_key = dict()
+                for position, key in enumerate(self.fields["keys"].tolist()):
+                    self._by_key.setdefault(key, []).append(position)
+            positions = self._by_key.get(dialogue_id, [])
+        return [self[p] for p in positions]
+
+    def select(self, **filters: str) -> npt.NDArray[np.int64]:
+        # e.g. store.select(player="gpt-4o", judge="claude-3-5-sonnet-20240620")
+        mask = np.ones(len(self), dtype=np.bool_)
+        for name, value in filters.items():
+            mask &= self.fields[name + "s"] == value
+        result: npt.NDArray[np.int64] = np.flatnonzero(mask)
+        return result
+
+    def has_source(self, source: str, fingerprint: Optional[List[int]] = None) -> bool:
+        if source not in self.source_fingerprints:
+            return False
+        return fingerprint is None or self.source_fingerprints[source] == fingerprint
+
+    def append_result(
+        self, source: str, data: Dict[str, Any], fingerprint: Optional[List[int]] = None
+    ) -> int:
+        index = ScoreIndex.from_result(data)
+        run = {
+            "source": source,
+            "judge": _model_name(data.get("judge")),
+            "interrogator": _model_name(data.get("interrogator")),
+        }
+        lines = []
+        for output, key in zip(data["outputs"], index.keys.tolist()):
+            record = {**output, "dialogue_id": key, "run": run}
+            lines.append((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        new_fields = {
+            "keys": index.keys,
+            "sources": np.array([source] * len(lines), dtype=np.str_),
+            "players": index.players,
+            "judges": index.judges,
+            "interrogators": np.array([run["interrogator"]] * len(lines), dtype=np.str_),
+            "final_scores": _final_scores(index),
+            "refusals": index.refusals(),
+        }
+        with self.lock:
+            start = int(self.offsets[-1])
+            with open(self.path, "ab") as w:
+                for line in lines:
+                    w.write(line)
+            lengths = np.cumsum([len(line) for line in lines], dtype=np.int64)
+            self.offsets = np.concatenate([self.offsets, start + lengths])
+            for name, values in new_fields.items():
+                self.fields[name] = np.concatenate([self.fields[name], values])
+            self.source_fingerprints[source] = fingerprint or []
+            self._save_index()
+            self._by_key = None
+            self._remap()
+        return len(lines)
+
+    def close(self) -> None:
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+
+def get_file_fingerprint(file_path: str) -> List[int]:
+    stat = os.stat(file_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def convert(input_dir: str, output_path: str) -> None:
+    # Appends every per-run result file under input_dir that is not in the store yet.
+    # A result file that changed after conversion is reported and skipped: the store is append-only.
+    store = TranscriptStore(output_path)
+    for root, _, _ in sorted(os.walk(input_dir)):
+        for file_name in list_result_files(root):
+            file_path = os.path.join(root, file_name)
+            source = os.path.relpath(file_path, input_dir)
+            fingerprint = get_file_fingerprint(file_path)
+            if store.has_source(source):
+                if not store.has_source(source, fingerprint):
+                    print(f"{source}: changed since conversion, skipped")
+                continue
+            data = load_result(file_path)
+            count = store.append_result(source, data, fingerprint)
+            print(f"{source}: {count} dialogues")
+    print(f"Total: {len(store)} dialogues in {output_path}")
+    store.close()
+
+
+if __name__ == "__main__":
+    fire.Fire(convert)
@@ -1,37 +1,103 @@
 import copy
 import json
-import shutil
+import re
 from collections import defaultdict
+from functools import lru_cache
 from statistics import mean
-from typing import Any, Dict, List, Optional, cast
+from typing import Any, Dict, List, Optional, Tuple, cast
 
 from jinja2 import Template
 from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 
-from src.data import ChatMessages
+from src.data import ChatMessages, get_dialogue_id
 from src.provider import LLMProvider
+from src.result_format import dump_result
+from src.score_index import write_score_index
 
 
-def encode_prompt(template_path: str, **kwargs: Any) -> str:
+@lru_cache(maxsize=None)
+def get_template(template_path: str) -> Template:
     with open(template_path, encoding="utf-8") as f:
-        template = Template(f.read())
+        return Template(f.read())
+
+
+def encode_prompt(template_path: str, **kwargs: Any) -> str:
+    template = get_template(template_path)
     return template.render(**kwargs).strip()
 
 
+JSON_TOKEN = re.compile(r'[{}\[\]",\\]')
+
+
+def scan_json_object(text: str, start: int) -> Optional[Tuple[int, str]]:
+    # One pass from the "{" at start to its matching "}", skipping brackets inside strings.
+    # Returns the end position and the object text with trailing commas removed.
+    depth = 0
+    in_string = False
+    skip_to = start
+    last_comma = -1
+    trailing_commas: List[int] = []
+    for match in JSON_TOKEN.finditer(text, start):
+        position = match.start()
+        if position < skip_to:
+            continue
+        char = match.group()
+        if in_string:
+            if char == "\\":
+                skip_to = position + 2
+            elif char == '"':
+                in_string = False
+            continue
+        if char == ",":
+            last_comma = position
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        else:
+            if last_comma != -1 and not text[last_comma + 1 : position].strip():
+                trailing_commas.append(last_comma)
+            depth -= 1
+            if depth == 0:
+                end = position + 1
+                bounds = [start - 1] + trailing_commas + [end]
+                return end, "".join(text[a + 1 : b] for a, b in zip(bounds, bounds[1:]))
+        last_comma = -1
+    return None
+
+
 def parse_output(output: str) -> Dict[str, Any]:
     start_index = output.find("{")
     end_index = output.rfind("}")
     text = output[start_index : end_index + 1]
-    text = text.strip()
-    record: Dict[str, Any] = json.loads(text)
+    try:
+        record = json.loads(text, strict=False)
+    except ValueError:
+        record = None
+    # Stray braces around the object or trailing commas inside it need the scanner.
+    # Only top-level objects are candidates, so a nested entry is never returned as the
+    # answer, and the scan moves past each candidate, so the text is read once.
+    while not isinstance(record, dict) and start_index != -1:
+        scanned = scan_json_object(output, start_index)
+        if scanned is None:
+            break
+        end, text = scanned
+        try:
+            record = json.loads(text, strict=False)
+        except ValueError:
+            pass
+        start_index = output.find("{", end)
+    if not isinstance(record, dict):
+        raise ValueError(f"No JSON object in the output: {output[:100]}")
     for k in record:
         assert isinstance(k, str)
     return record
 
 
-def generate(
-    messages: ChatMessages, provider: LLMProvider, fix_double_spaces: bool = True, **kwargs: Any
-) -> str:
+def prepare_request(
+    messages: ChatMessages, provider: LLMProvider, **kwargs: Any
+) -> Tuple[List[ChatCompletionMessageParam], Dict[str, Any]]:
     params = copy.deepcopy(provider.params)
     for k, v in kwargs.items():
         params[k] = v
@@ -49,13 +115,33 @@ def generate(
         messages_copy[0]["content"] = f"{system_content}\n\nUser: {user_content}"
 
     casted_messages = [cast(ChatCompletionMessageParam, message) for message in messages_copy]
+    return casted_messages, params
+
+
+def generate_choices(
+    messages: ChatMessages,
+    provider: LLMProvider,
+    n: int = 1,
+    fix_double_spaces: bool = True,
+    **kwargs: Any,
+) -> List[str]:
+    casted_messages, params = prepare_request(messages, provider, **kwargs)
+    if n > 1:
+        params["n"] = n
     chat_completion = provider.api.chat.completions.create(
         model=provider.model_name, messages=casted_messages, **params
     )
-    output = str(chat_completion.choices[0].message.content).strip()
+    # Endpoints without "n" support return a single choice
+    outputs = [str(choice.message.content).strip() for choice in chat_completion.choices]
     if fix_double_spaces:
-        output = output.replace("  ", " ")
-    return output
+        outputs = [output.replace("  ", " ") for output in outputs]
+    return outputs
+
+
+def generate(
+    messages: ChatMessages, provider: LLMProvider, fix_double_spaces: bool = True, **kwargs: Any
+) -> str:
+    return generate_choices(messages, provider, fix_double_spaces=fix_double_spaces, **kwargs)[0]
 
 
 def save(
@@ -66,7 +152,12 @@ def save(
     player_provider: Optional[Dict[str, Any]],
     version: Optional[int],
     score_key: str = "scores",
+    compact: bool = False,
 ) -> None:
+    player_name = player_provider.get("model_name") if player_provider else None
+    for o in outputs:
+        o["dialogue_id"] = get_dialogue_id(o, player_name)
+
     scores: Dict[str, List[int]] = defaultdict(list)
     refusal_count = sum([int(max(o[score_key]["is_refusal"])) for o in outputs])
     for o in outputs:
@@ -83,20 +174,14 @@ def save(
         agg_scores["final_score"] = mean(agg_scores.values())
     refusal_ratio = refusal_count / len(outputs)
 
-    tmp_path = output_path + "_tmp"
-    with open(tmp_path, "w", encoding="utf-8") as w:
-        json.dump(
-            {
-                "outputs": outputs,
-                "version": version,
-                "refusal_ratio": refusal_ratio,
-                "judge": judge_provider,
-                "interrogator": interrogator_provider,
-                "player": player_provider,
-                **agg_scores,
-            },
-            w,
-            ensure_ascii=False,
-            indent=4,
-        )
-    shutil.move(tmp_path, output_path)
+    data = {
+        "outputs": outputs,
+        "version": version,
+        "refusal_ratio": refusal_ratio,
+        "judge": judge_provider,
+        "interrogator": interrogator_provider,
+        "player": player_provider,
+        **agg_scores,
+    }
+    dump_result(output_path, data, compact=compact)
+    write_score_index(output_path, data)